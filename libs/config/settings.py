@@ -30,7 +30,56 @@ class Settings(BaseSettings):
     tx_reference_prefix: str = "SFH"
     tx_reference_length: int = 24
     tx_validity_lax_mins: int = 5
+    tx_pending_expiry_mins: int = 60 * 24
+    tx_sweep_interval_mins: int = 5
+    tx_sweep_batch_size: int = 100
+    tx_sweep_concurrency: int = 8
+    tx_sweep_max_per_run: int = 2000
+    paginator_count_cap: int = 10000
+    asset_cache_ttl_secs: int = 30
+    asset_cache_max_size: int = 1024
+    auth_cache_ttl_secs: int = 10
+    auth_cache_max_size: int = 4096
+    session_usage_flush_secs: float = 5
+    session_usage_max_pending: int = 500
+    ensure_indexes_on_startup: bool = True
+    http_pool_hosts: int = 10
+    http_pool_per_host: int = 20
+    http_max_concurrency: int = 40
+    http_connect_timeout_secs: float = 5
+    http_read_timeout_secs: float = 30
+    http_breaker_failure_threshold: int = 5
+    http_breaker_reset_secs: float = 30
+    http_retry_backoff_base_secs: float = 0.25
+    http_retry_backoff_cap_secs: float = 2
+    metrics_api_key: str = ""
+    banks_catalog_ttl_secs: int = 60 * 60 * 24
+    banks_catalog_stale_secs: int = 60 * 60 * 24 * 7
+    bank_account_cache_ttl_secs: int = 60 * 60
+    bank_account_negative_cache_ttl_secs: int = 60 * 5
+    bank_account_cache_max_size: int = 4096
     db_url: str = "mongodb://localhost:4000"
+    huey_backend: str = "mongo"
+    huey_default_workers: int = 6
+    huey_default_worker_type: str = "thread"
+    huey_email_workers: int = 8
+    huey_email_worker_type: str = "thread"
+    huey_kyc_workers: int = 4
+    huey_kyc_worker_type: str = "thread"
+    task_metrics_flush_secs: float = 15
+    task_metrics_report_hours: int = 24
+    task_metrics_retention_days: int = 30
+    task_dead_letter_retention_days: int = 90
+    task_buffer_batch_size: int = 100
+    task_buffer_flush_secs: float = 0.05
+    task_buffer_max_pending: int = 10000
+    task_buffer_retry_secs: float = 1
+    notification_batch_size: int = 200
+    notification_flush_secs: float = 0.25
+    notification_max_pending: int = 10000
+    notification_retry_secs: float = 1
+    notification_user_cache_size: int = 100000
+    notification_wait_secs: float = 30
     mail_username: str = "Safehome"
     mail_password: str = "mail_pass"
     mail_from: str = "Safehometeam@Safehome.xyz"
@@ -38,6 +87,20 @@ class Settings(BaseSettings):
     mail_server:  str = "https://mail.com"
     mail_starttls: bool = False
     mail_ssl_tls:  bool = True
+    smtp_timeout_secs: float = 30
+    smtp_pool_size: int = 4
+    smtp_max_messages_per_connection: int = 100
+    smtp_noop_after_secs: float = 5
+    smtp_max_idle_secs: float = 60
+    email_template_cache_dir: str = "/tmp/safehome-email-templates"
+    email_outbox_batch_size: int = 100
+    email_outbox_concurrency: int = 4
+    email_outbox_max_attempts: int = 5
+    email_outbox_retry_delay_secs: float = 30
+    email_outbox_linger_secs: float = 5
+    email_outbox_retention_days: int = 7
+    email_domain_rate_per_sec: float = 10
+    email_domain_rate_overrides: dict[str, float] = {}
     mail_display_name: str = "Safehome Cooperative"
     mail_domain:  str = "https://mail.com"
     mail_domain_username:  str = "admin"
@@ -52,11 +115,17 @@ class Settings(BaseSettings):
     flutterwave_public_key: str = "flutterwavepublickey"
     flutterwave_secret_key: str = "flutterwavesecretkey"
     flutterwave_encryption_key: str = "flutterwaveencryptionkey"
+    flutterwave_webhook_hash: str = ""
     verifyme_secret_key: str = "verifymesecretkey"
     quore_id_client_id: str = ""
     quore_id_secret_key: str = ""
     quore_id_api_token: str = ""
     quore_id_api_url: str = "https://api.qoreid.com"
+    quore_id_token_default_ttl_secs: int = 3600
+    quore_id_token_refresh_margin_secs: int = 120
+    kyc_auto_approve: bool = True
+    kyc_verification_deadline_secs: float = 25
+    kyc_verification_workers: int = 8
     referral_withdrawal_threshold: float = 5000
     referral_bonus: float = 2000
     affiliate_bonus: float = 2000
@@ -1,10 +1,16 @@
+import sys
+import asyncio
 from motor import motor_asyncio
+from pymongo import IndexModel, ASCENDING, DESCENDING
 from libs.config.settings import get_settings
+from libs.logging import Logger
 from enum import Enum
 
 
 settings = get_settings()
 
+logger = Logger(f"{__package__}.{__name__}")
+
 
 class Collections(str, Enum):
     users = "users"
@@ -30,9 +36,164 @@ class Collections(str, Enum):
     referrals = "referrals"
     affiliate_profiles = "affiliate_profiles"
     affiliate_referrals = "affiliate_referrals"
+    payment_events = "payment_events"
+    email_outbox = "email_outbox"
+    task_metrics = "task_metrics"
+    task_dead_letters = "task_dead_letters"
+
+
+# Indexes backing the hot lookups and list queries of each collection.
+# Applied idempotently by ensure_indexes() at startup or with `python -m libs.db ensure-indexes`.
+INDEXES: dict[Collections, list[IndexModel]] = {
+    Collections.users: [
+        IndexModel([("uid", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)]),
+        IndexModel([("phone", ASCENDING)]),
+    ],
+    Collections.authsessions: [
+        IndexModel([("uid", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING)]),
+    ],
+    Collections.authcodes: [
+        IndexModel([("code", ASCENDING)]),
+    ],
+    Collections.wallets: [
+        IndexModel([("uid", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING)]),
+    ],
+    Collections.transactions: [
+        IndexModel([("reference", ASCENDING)], unique=True),
+        IndexModel([("wallet", ASCENDING), ("created_at", DESCENDING), ("uid", DESCENDING)]),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    Collections.payment_events: [
+        IndexModel([("uid", ASCENDING)], unique=True),
+        IndexModel([("event_key", ASCENDING)], unique=True),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)]),
+    ],
+    Collections.email_outbox: [
+        IndexModel([("uid", ASCENDING)], unique=True),
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)]),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    Collections.task_metrics: [
+        IndexModel([("task_name", ASCENDING), ("hour", ASCENDING)], unique=True),
+        IndexModel([("hour", ASCENDING)]),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    Collections.task_dead_letters: [
+        IndexModel([("uid", ASCENDING)], unique=True),
+        IndexModel([("task_name", ASCENDING), ("failed_at", DESCENDING)]),
+        IndexModel([("failed_at", DESCENDING)]),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    Collections.bank_accounts: [
+        IndexModel([("uid", ASCENDING)], unique=True),
+        IndexModel([("wallet", ASCENDING)]),
+    ],
+    Collections.debitcards: [
+        IndexModel([("wallet", ASCENDING), ("created_at", DESCENDING), ("uid", DESCENDING)]),
+    ],
+    Collections.investible_assets: [
+        IndexModel([("uid", ASCENDING)], unique=True),
+        IndexModel([("is_active", ASCENDING), ("owner_club", ASCENDING), ("asset_name", ASCENDING)]),
+    ],
+    Collections.investments: [
+        IndexModel([("uid", ASCENDING)], unique=True),
+        IndexModel([("payment_reference", ASCENDING)]),
+        IndexModel([("investor_uid", ASCENDING), ("is_active", ASCENDING), ("completed", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("investor_uid", ASCENDING), ("asset_uid", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+    Collections.notifications: [
+        IndexModel([("uid", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("deleted", ASCENDING), ("created_at", DESCENDING), ("uid", DESCENDING)]),
+        IndexModel([("dedupe_key", ASCENDING)], unique=True,
+                   partialFilterExpression={"dedupe_key": {"$type": "string"}}),
+    ],
+    Collections.notification_preferences: [
+        IndexModel([("user_id", ASCENDING)]),
+    ],
+    Collections.goal_savings_plans: [
+        IndexModel([("uid", ASCENDING)], unique=True),
+        IndexModel([("payment_references", ASCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("is_active", ASCENDING), ("completed", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+    Collections.locked_savings_plans: [
+        IndexModel([("uid", ASCENDING)], unique=True),
+        IndexModel([("payment_references", ASCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("is_active", ASCENDING), ("completed", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+    Collections.referral_profiles: [
+        IndexModel([("user_id", ASCENDING)]),
+        IndexModel([("referral_code", ASCENDING)]),
+    ],
+    Collections.referrals: [
+        IndexModel([("referred_user_id", ASCENDING)]),
+        IndexModel([("referred_by", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+    Collections.affiliate_profiles: [
+        IndexModel([("user_id", ASCENDING)]),
+        IndexModel([("referral_codes.code", ASCENDING)]),
+    ],
+    Collections.affiliate_referrals: [
+        IndexModel([("referred_user_id", ASCENDING)]),
+        IndexModel([("affiliate", ASCENDING), ("created_at", DESCENDING)]),
+    ],
+}
 
 
 client = motor_asyncio.AsyncIOMotorClient(settings.db_url)
 
 
 _db = client[settings.db_name]
+
+
+async def ensure_indexes():
+    """ Create every index declared in INDEXES; existing identical indexes are left untouched. """
+
+    created = {}
+
+    for col_name, indexes in INDEXES.items():
+        try:
+            created[col_name.value] = await _db[col_name].create_indexes(indexes)
+
+        except Exception as e:
+            created[col_name.value] = []
+            logger.error(
+                f"Unable to create indexes on {col_name.value} - {e}")
+
+    return created
+
+
+async def index_report():
+    """ Report declared indexes that are missing and existing indexes that have not been used since the last restart. """
+
+    report = {}
+
+    for col_name in Collections:
+        declared = {index.document["name"]
+                    for index in INDEXES.get(col_name, [])}
+
+        stats = await _db[col_name].aggregate([{"$indexStats": {}}]).to_list(length=None)
+
+        existing = {stat["name"]: stat["accesses"]["ops"] for stat in stats}
+
+        report[col_name.value] = {
+            "missing": sorted(declared - set(existing)),
+            "unused": sorted(name for name, ops in existing.items() if ops == 0 and name != "_id_"),
+            "undeclared": sorted(set(existing) - declared - {"_id_"}),
+        }
+
+    return report
+
+
+if __name__ == "__main__":
+    import json
+
+    commands = {"ensure-indexes": ensure_indexes, "index-report": index_report}
+
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print(f"usage: python -m libs.db [{' | '.join(commands)}]")
+        sys.exit(1)
+
+    print(json.dumps(asyncio.run(commands[sys.argv[1]]()), indent=2))
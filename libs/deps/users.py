@@ -1,8 +1,10 @@
 from typing import Union
-from fastapi import HTTPException,  BackgroundTasks, Depends, Header
+from fastapi import HTTPException, Depends, Header, Request
 from pydantic import EmailStr
 from libs.db import _db, Collections
-from libs.utils.api_helpers import update_record
+from libs.utils.api_helpers import update_record, register_write_hook
+from libs.utils.cache import TTLCache
+from libs.utils.session_usage import session_usage
 from libs.config.settings import get_settings
 from models.users import AuthenticationContext,  RequestAccountConfirmationInput, UserDBModel, AuthSession, AuthCode, UserRoles, USER_EXLUCUDE_FIELDS, UserOutputModel, KYCStatus
 from models.wallets import Wallet
@@ -18,7 +20,61 @@ oauth2_scheme = OAuth2PasswordBearer(
 settings = get_settings()
 
 
-async def __get_auth_context(bg_tasks, token):
+# resolved (user, session) documents keyed by session id
+auth_cache = TTLCache("auth_context", ttl=settings.auth_cache_ttl_secs,
+                      max_size=settings.auth_cache_max_size)
+
+
+def invalidate_auth_cache(user_id: str | None = None, session_id: str | None = None):
+    if session_id:
+        auth_cache.invalidate(session_id)
+
+    if user_id:
+        auth_cache.invalidate_where(
+            lambda _, entry: entry["user"]["uid"] == user_id)
+
+
+def _on_user_write(pk_name, pk):
+    if pk_name == "uid":
+        invalidate_auth_cache(user_id=pk)
+    else:
+        auth_cache.clear()
+
+
+def _on_session_write(pk_name, pk):
+    if pk_name == "uid":
+        invalidate_auth_cache(session_id=pk)
+    else:
+        auth_cache.clear()
+
+
+register_write_hook(Collections.users, _on_user_write)
+# usage counters are flushed constantly and never change whether a session is accepted
+register_write_hook(Collections.authsessions, _on_session_write,
+                    ignore_fields={"last_used", "usage_count"})
+
+
+async def __load_auth_entry(user_id: str, session_id: str):
+    entry = auth_cache.get(session_id)
+
+    if entry is not None and entry["user"]["uid"] == user_id:
+        return entry["user"], entry["session"]
+
+    user = await _db[Collections.users].find_one({"uid": user_id})
+
+    if not user:
+        return None, None
+
+    auth_session = await _db[Collections.authsessions].find_one({"uid": session_id})
+
+    # an invalidated session is rejected from the database on every request, never from the cache
+    if auth_session and auth_session.get("is_valid", True):
+        auth_cache.set(session_id, {"user": user, "session": auth_session})
+
+    return user, auth_session
+
+
+async def __get_auth_context(token):
     if not token:
         raise HTTPException(
             401, "unauthenticated request : no authorization header present", headers={"WWW-Authenticate": "Bearer", "X-ACTION": "SIGN_IN"})
@@ -27,16 +83,14 @@ async def __get_auth_context(bg_tasks, token):
 
     user_id = payload["sub"]["user_id"]
 
-    user = await _db[Collections.users].find_one({"uid": user_id})
+    session_id = payload["sub"]["session_id"]
+
+    user, auth_session = await __load_auth_entry(user_id, session_id)
 
     if not user:
         raise HTTPException(401, f"unauthenticated request : user not found ", headers={
                             "WWW-Authenticate": "Bearer", "X-ACTION": "SIGN_IN"})
 
-    session_id = payload["sub"]["session_id"]
-
-    auth_session = await _db[Collections.authsessions].find_one({"uid": session_id})
-
     if not auth_session:
         raise HTTPException(
             401, f"unauthenticated request : session not found ", headers={"WWW-Authenticate": "Bearer", "X-ACTION": "SIGN_IN"})
@@ -65,13 +119,8 @@ async def __get_auth_context(bg_tasks, token):
     session.last_used = get_utc_timestamp()
     session.usage_count += 1
 
-    async def make_update(uid, last_used, usage_count):
-
-        await _db[Collections.authsessions].update_one(
-            {"uid": uid}, {"$set": {"last_used": last_used, "usage_count": usage_count}})
-
-    bg_tasks.add_task(make_update, session.uid,
-                      session.last_used, session.usage_count)
+    # usage is coalesced per session and written in bulk by the write-behind buffer
+    session_usage.record(session.uid, session.last_used)
 
     _user_model = UserDBModel(**user)
 
@@ -81,16 +130,33 @@ async def __get_auth_context(bg_tasks, token):
     )
 
 
-async def get_auth_context(bg_tasks: BackgroundTasks, token: str = Depends(oauth2_scheme)) -> AuthenticationContext:
-    return await __get_auth_context(bg_tasks, token)
+async def __get_request_auth_context(request: Request, token):
+
+    # get_auth_context and get_auth_context_optionally are distinct dependencies, so FastAPI
+    # resolves both on routes that use them; share one resolved context per request instead
+    state = request.state
+
+    if getattr(state, "auth_token", None) == token and getattr(state, "auth_context", None) is not None:
+        return state.auth_context
+
+    auth_context = await __get_auth_context(token)
+
+    state.auth_token = token
+    state.auth_context = auth_context
+
+    return auth_context
 
 
-async def get_auth_context_optionally(bg_tasks: BackgroundTasks, token: str = Depends(oauth2_scheme)) -> Union[AuthenticationContext, None]:
+async def get_auth_context(request: Request, token: str = Depends(oauth2_scheme)) -> AuthenticationContext:
+    return await __get_request_auth_context(request, token)
+
+
+async def get_auth_context_optionally(request: Request, token: str = Depends(oauth2_scheme)) -> Union[AuthenticationContext, None]:
 
     if not token:
         return None
 
-    return await __get_auth_context(bg_tasks, token)
+    return await __get_request_auth_context(request, token)
 
 
 async def get_user_wallet(context: AuthenticationContext = Depends(get_auth_context)) -> Wallet:
@@ -123,6 +189,20 @@ async def only_affiliates(context:  AuthenticationContext = Depends(get_auth_con
     return True
 
 
+async def __refresh_user(context: AuthenticationContext):
+    """ Re-read the user of a context that is about to be rejected, in case the cached copy
+    predates a payment or KYC decision written by the task queue.
+    """
+
+    user = await _db[Collections.users].find_one({"uid": context.user.uid})
+
+    if user is None:
+        return
+
+    invalidate_auth_cache(user_id=context.user.uid)
+    context.user = UserDBModel(**user)
+
+
 async def only_kyc_verified_users(context: AuthenticationContext | None = Depends(get_auth_context_optionally)):
 
     if context is None:
@@ -130,6 +210,9 @@ async def only_kyc_verified_users(context: AuthenticationContext | None = Depend
 
     return True
 
+    if not context.user.kyc_status == KYCStatus.APPROVED:
+        await __refresh_user(context)
+
     if not context.user.kyc_status == KYCStatus.APPROVED:
         if context.user.kyc_status == KYCStatus.PENDING:
             raise HTTPException(
@@ -147,6 +230,9 @@ async def only_paid_users(context: AuthenticationContext | None = Depends(get_au
     if context is None:
         return
 
+    if not context.user.has_paid_membership_fee:
+        await __refresh_user(context)
+
     if not context.user.has_paid_membership_fee:
         raise HTTPException(
             status_code=400, detail="You must pay your membership fee to perform this action.")
@@ -0,0 +1,192 @@
+import time
+import threading
+from datetime import datetime, timezone, timedelta
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from libs.config.settings import get_settings
+from libs.utils.pure_functions import get_utc_timestamp
+from models.emails import OutboxEmailStatus
+from .config import EMAIL_DEFS
+from .send_email import dispatch_email
+from .smtp_pool import SMTPDeliveryUnknown
+from .render_template import render_many
+from libs.logging import Logger
+
+
+settings = get_settings()
+
+logger = Logger(f"{__package__}.{__name__}")
+
+
+def recipient_domain(email_to: str | list[str]) -> str:
+    first = email_to if isinstance(email_to, str) else email_to[0]
+    return first.rsplit("@", 1)[-1].lower()
+
+
+class DomainRateLimiter:
+    "A token bucket per recipient domain, refilled at the domain's messages-per-second rate"
+
+    def __init__(self, default_rate: float, overrides: dict[str, float] = {}) -> None:
+        self.default_rate = default_rate
+        self.overrides = overrides
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, domain: str) -> float:
+        "Take a token, returning 0 on success or the seconds until one is available"
+
+        rate = self.overrides.get(domain, self.default_rate)
+        # at least one token, so that rates below one message a second still send
+        capacity = max(1.0, rate)
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated = self._buckets.get(domain, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+
+            if tokens >= 1:
+                self._buckets[domain] = (tokens - 1, now)
+                return 0
+
+            self._buckets[domain] = (tokens, now)
+            return (1 - tokens) / rate
+
+
+def _render_batch(emails: list[dict]) -> dict[str, str]:
+    "Render the batch once per email type, returning the content of each message by uid"
+
+    by_type: dict[str, list[dict]] = {}
+
+    for email in emails:
+        if email["email_type"] in EMAIL_DEFS:
+            by_type.setdefault(email["email_type"], []).append(email)
+
+    contents = {}
+
+    for email_type, group in by_type.items():
+        try:
+            rendered = render_many(EMAIL_DEFS[email_type]["template_name"], [
+                                   email["email_data"] for email in group])
+
+        except Exception as e:
+            # leave these to dispatch_email, which renders and reports each one itself
+            logger.error(f"Unable to render {email_type} emails in bulk - {e}")
+            continue
+
+        contents.update(
+            {email["uid"]: content for email, content in zip(group, rendered)})
+
+    return contents
+
+
+def _expires_at(now: float) -> datetime:
+    "When a sent, failed or unconfirmed message, and the OTPs and links in its email_data, are removed by the TTL index"
+
+    return datetime.fromtimestamp(now, tz=timezone.utc) + timedelta(days=settings.email_outbox_retention_days)
+
+
+def _send(email: dict, content: str | None, send) -> tuple[str, UpdateOne]:
+    now = get_utc_timestamp()
+    attempts = email["attempts"] + 1
+
+    try:
+        send(email["email_to"], email["email_type"],
+             email["email_data"], content=content)
+
+    except SMTPDeliveryUnknown as e:
+        # sending again could deliver the message twice
+        update = {
+            "status": OutboxEmailStatus.unconfirmed,
+            "attempts": attempts,
+            "last_error": str(e),
+            "updated_at": now,
+            "expires_at": _expires_at(now),
+        }
+
+        return "unconfirmed", UpdateOne({"uid": email["uid"]}, {"$set": update})
+
+    except Exception as e:
+        # an unknown email type will never succeed, everything else is retried with backoff
+        retry = not isinstance(
+            e, ValueError) and attempts < settings.email_outbox_max_attempts
+
+        update = {
+            "status": OutboxEmailStatus.queued if retry else OutboxEmailStatus.failed,
+            "attempts": attempts,
+            "last_error": str(e),
+            "next_attempt_at": now + settings.email_outbox_retry_delay_secs * (2 ** (attempts - 1)),
+            "updated_at": now,
+        }
+
+        if not retry:
+            update["expires_at"] = _expires_at(now)
+
+        return "retried" if retry else "failed", UpdateOne({"uid": email["uid"]}, {"$set": update})
+
+    update = {
+        "status": OutboxEmailStatus.sent,
+        "attempts": attempts,
+        "sent_at": now,
+        "updated_at": now,
+        "expires_at": _expires_at(now),
+    }
+
+    return "sent", UpdateOne({"uid": email["uid"]}, {"$set": update})
+
+
+def drain_outbox(outbox: Collection, limiter: DomainRateLimiter, send=dispatch_email) -> Counter:
+    """ Send every due message in the outbox, a batch at a time, over the pooled SMTP connections.
+
+    Messages whose domain is over its rate limit are pushed back until a token is free; if the
+    outbox only holds such messages the drain waits for them for up to email_outbox_linger_secs.
+    Must not run concurrently with itself, callers hold a lock.
+    """
+
+    outcomes = Counter()
+
+    with ThreadPoolExecutor(max_workers=settings.email_outbox_concurrency) as executor:
+
+        while True:
+
+            now = get_utc_timestamp()
+
+            batch = list(outbox.find({"status": OutboxEmailStatus.queued, "next_attempt_at": {"$lte": now}}).sort(
+                "next_attempt_at", 1).limit(settings.email_outbox_batch_size))
+
+            if not batch:
+                upcoming = outbox.find_one({"status": OutboxEmailStatus.queued}, {"next_attempt_at": 1}, sort=[
+                                           ("next_attempt_at", 1)])
+
+                if upcoming is None or upcoming["next_attempt_at"] - now > settings.email_outbox_linger_secs:
+                    break
+
+                time.sleep(max(0, upcoming["next_attempt_at"] - now))
+                continue
+
+            ready = []
+            ops = []
+
+            for email in batch:
+                wait = limiter.acquire(email["domain"])
+
+                if wait:
+                    outcomes["deferred"] += 1
+                    ops.append(UpdateOne({"uid": email["uid"]}, {
+                               "$set": {"next_attempt_at": now + wait}}))
+                else:
+                    ready.append(email)
+
+            contents = _render_batch(ready)
+
+            for outcome, op in executor.map(lambda email: _send(email, contents.get(email["uid"], None), send), ready):
+                outcomes[outcome] += 1
+                ops.append(op)
+
+            outbox.bulk_write(ops, ordered=False)
+
+    if outcomes:
+        logger.info(f"Email outbox drained - {dict(outcomes)}")
+
+    return outcomes
@@ -1,15 +1,113 @@
-from jinja2 import Environment, PackageLoader, select_autoescape
+import os
+import re
+from functools import lru_cache
+from jinja2 import Environment, PackageLoader, FileSystemBytecodeCache, meta, nodes, select_autoescape
+from markupsafe import escape
 from libs.config.settings import get_settings
+from libs.logging import Logger
+from .config import EMAIL_DEFS
 
 settings = get_settings()
 
+logger = Logger(f"{__package__}.{__name__}")
+
+
+os.makedirs(settings.email_template_cache_dir, exist_ok=True)
 
 env = Environment(
     loader=PackageLoader("libs.emails", "templates"),
-    autoescape=select_autoescape()
+    autoescape=select_autoescape(),
+    bytecode_cache=FileSystemBytecodeCache(settings.email_template_cache_dir),
 )
 
+# variables each email type's template reads, filled in by precompile_templates()
+TEMPLATE_VARIABLES: dict[str, set[str]] = {}
+
+
+def precompile_templates():
+    """ Compile every template named in EMAIL_DEFS so that a missing or broken template fails
+    at startup rather than on the first send. Compiled bytecode is shared through the cache dir. """
+
+    errors = []
+
+    for email_type, conf in EMAIL_DEFS.items():
+        try:
+            env.get_template(conf["template_name"])
+
+            source, _, _ = env.loader.get_source(env, conf["template_name"])
+            TEMPLATE_VARIABLES[email_type] = meta.find_undeclared_variables(
+                env.parse(source)) - {"settings"}
+
+        except Exception as e:
+            errors.append(f"{email_type} ({conf['template_name']}): {e}")
+
+    if errors:
+        raise RuntimeError(
+            "Invalid email templates - " + "; ".join(errors))
+
+    logger.info(f"Precompiled {len(TEMPLATE_VARIABLES)} email templates")
+
 
 def render_to_string(template_name: str, **kwargs):
     template = env.get_template(template_name)
     return template.render(**kwargs, settings=settings)
+
+
+@lru_cache(maxsize=256)
+def _printed_only(template_name: str, names: tuple[str]) -> bool:
+    "Whether every use of the named variables in the template is a bare {{ name }}"
+
+    source, _, _ = env.loader.get_source(env, template_name)
+    ast = env.parse(source)
+
+    if any(True for _ in ast.find_all((nodes.Extends, nodes.Include, nodes.Import, nodes.FromImport))):
+        return False
+
+    printed = {id(node) for output in ast.find_all(nodes.Output)
+               for node in output.nodes if isinstance(node, nodes.Name)}
+
+    return all(id(node) in printed for node in ast.find_all(nodes.Name) if node.name in names)
+
+
+def render_many(template_name: str, contexts: list[dict]) -> list[str]:
+    """ Render one template for many recipients.
+
+    Variables that are the same for every recipient are rendered once, and the ones that differ are
+    substituted into that render. This only holds when the differing variables are printed as is,
+    so each recipient gets a full render when the template uses them any other way (in a
+    condition, a filter, ...).
+    """
+
+    if len(contexts) < 2:
+        return [render_to_string(template_name, **context) for context in contexts]
+
+    keys = set().union(*contexts)
+    first = contexts[0]
+
+    varying = sorted(key for key in keys if any(
+        key not in context or context[key] != first.get(key, None) for context in contexts))
+
+    if not varying:
+        return [render_to_string(template_name, **first)] * len(contexts)
+
+    if any(not isinstance(context.get(key, None), (str, int, float)) for context in contexts for key in varying) \
+            or not _printed_only(template_name, tuple(varying)):
+        return [render_to_string(template_name, **context) for context in contexts]
+
+    shared = {key: first[key] for key in keys if key not in varying}
+    markers = {key: f"__SFH_VAR_{i}__" for i, key in enumerate(varying)}
+
+    rendered = render_to_string(template_name, **shared, **markers)
+
+    key_by_marker = {marker: key for key, marker in markers.items()}
+    parts = re.split(
+        "(" + "|".join(map(re.escape, key_by_marker)) + ")", rendered)
+
+    escaped = env.autoescape(template_name) if callable(
+        env.autoescape) else env.autoescape
+
+    def value(context, key):
+        return str(escape(context[key])) if escaped else str(context[key])
+
+    return ["".join(value(context, key_by_marker[part]) if part in key_by_marker else part for part in parts)
+            for context in contexts]
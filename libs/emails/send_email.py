@@ -1,10 +1,10 @@
-import smtplib
 from pydantic import EmailStr
 from libs.config.settings import get_settings
 from .config import EMAIL_DEFS
 from email.message import EmailMessage
 from email.headerregistry import Address
 from .render_template import render_to_string
+from .smtp_pool import smtp_pool, SMTPDeliveryUnknown
 from libs.logging import Logger
 
 
@@ -13,7 +13,8 @@ settings = get_settings()
 logger = Logger(f"{__package__}.{__name__}")
 
 
-def dispatch_email(email_to: list[EmailStr] | EmailStr, email_type: str, email_data: dict):
+def dispatch_email(email_to: list[EmailStr] | EmailStr, email_type: str, email_data: dict, content: str | None = None):
+    "Send one email, rendering its template unless the caller passes the rendered `content`"
 
     if not email_type in EMAIL_DEFS:
         raise ValueError("Invalid email type")
@@ -22,22 +23,25 @@ def dispatch_email(email_to: list[EmailStr] | EmailStr, email_type: str, email_d
 
     try:
 
-        with smtplib.SMTP_SSL(settings.mail_server, settings.mail_port) as smtp:
-            # smtp.starttls()
-            smtp.login(settings.mail_username, settings.mail_password)
-            email_content = render_to_string(
-                conf['template_name'], **email_data)
+        email_content = content if content is not None else render_to_string(
+            conf['template_name'], **email_data)
 
-            msg = EmailMessage()
-            msg['Subject'] = conf['subject']
-            msg['From'] = Address(
-                settings.mail_display_name, settings.mail_domain_username, settings.mail_domain)
-            msg['To'] = email_to if isinstance(
-                email_to, str) else ",".join(email_to)
+        msg = EmailMessage()
+        msg['Subject'] = conf['subject']
+        msg['From'] = Address(
+            settings.mail_display_name, settings.mail_domain_username, settings.mail_domain)
+        msg['To'] = email_to if isinstance(
+            email_to, str) else ",".join(email_to)
 
-            msg.set_content(email_content, subtype="html")
+        msg.set_content(email_content, subtype="html")
 
-            smtp.sendmail(conf['mail_from'], email_to, msg.as_string())
+        smtp_pool.sendmail(conf['mail_from'], email_to, msg.as_string())
+
+    except SMTPDeliveryUnknown as e:
+        logger.error(
+            f"Email {conf['template_name']} to {email_to} may not have been sent - {e}")
+
+        raise
 
     except Exception as e:
 
@@ -51,7 +55,7 @@ def dispatch_email(email_to: list[EmailStr] | EmailStr, email_type: str, email_d
 
         logger.error(str(e))
 
-        raise Exception("Email failed to send")
+        raise Exception(f"Email failed to send - {e}")
 
     else:
         logger.info(
@@ -0,0 +1,223 @@
+import time
+import queue
+import socket
+import smtplib
+import threading
+from libs.config.settings import get_settings
+from libs.logging import Logger
+
+
+settings = get_settings()
+
+logger = Logger(f"{__package__}.{__name__}")
+
+
+def connect_smtp():
+    "Open and log in to the configured mail server"
+
+    if settings.mail_ssl_tls:
+        smtp = smtplib.SMTP_SSL(settings.mail_server, settings.mail_port,
+                                timeout=settings.smtp_timeout_secs)
+    else:
+        smtp = smtplib.SMTP(settings.mail_server, settings.mail_port,
+                            timeout=settings.smtp_timeout_secs)
+
+        if settings.mail_starttls:
+            smtp.starttls()
+
+    smtp.login(settings.mail_username, settings.mail_password)
+
+    return smtp
+
+
+class SMTPDeliveryUnknown(Exception):
+    "The connection failed after the message was handed to the server, which may have delivered it"
+
+
+def deliver(smtp: smtplib.SMTP, from_addr: str, to_addrs, msg: str):
+    """ smtplib's sendmail, split at the DATA command so that a failed connection can be placed
+    before the message was handed over (safe to send again) or after it (SMTPDeliveryUnknown).
+    """
+
+    if isinstance(to_addrs, str):
+        to_addrs = [to_addrs]
+
+    smtp.ehlo_or_helo_if_needed()
+
+    code, resp = smtp.mail(from_addr)
+
+    if code != 250:
+        smtp.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+
+    refused = {}
+
+    for addr in to_addrs:
+        code, resp = smtp.rcpt(addr)
+
+        if code not in (250, 251):
+            refused[addr] = (code, resp)
+
+    if len(refused) == len(to_addrs):
+        smtp.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    try:
+        code, resp = smtp.data(msg)
+
+    except smtplib.SMTPResponseException:
+        # the server answered and refused the message
+        raise
+
+    except OSError as e:
+        raise SMTPDeliveryUnknown(
+            f"SMTP connection failed while sending the message, it may have been delivered - {e}") from e
+
+    if code != 250:
+        smtp.rset()
+        raise smtplib.SMTPDataError(code, resp)
+
+    return refused
+
+
+class PooledConnection:
+
+    def __init__(self, smtp: smtplib.SMTP) -> None:
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except Exception:
+            self.smtp.close()
+
+
+class SMTPPool:
+    """ Keeps logged-in SMTP connections open between sends.
+
+    A connection idle for more than `noop_after` seconds is checked with NOOP before reuse, one idle
+    for more than `max_idle` seconds is dropped, and each connection is retired after
+    `max_messages` sends. A send that finds the connection dead before the message was handed
+    over is retried once on a fresh one; a connection lost after that raises SMTPDeliveryUnknown
+    instead, as sending again could deliver the message twice.
+    At most `size` connections are open at once, further sends wait for one to be released.
+    """
+
+    def __init__(self, connect=connect_smtp, size: int = 4, max_messages: int = 100, noop_after: float = 5, max_idle: float = 60) -> None:
+        self.connect = connect
+        self.size = size
+        self.max_messages = max_messages
+        self.noop_after = noop_after
+        self.max_idle = max_idle
+        self.connects = 0
+        self.reused = 0
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        # held for as long as a connection is in use; new connections are only opened when none is
+        # idle, so this also bounds the idle and in use connections together
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _open(self) -> PooledConnection:
+        with self._lock:
+            self.connects += 1
+
+        return PooledConnection(self.connect())
+
+    def _is_alive(self, conn: PooledConnection) -> bool:
+        idle = time.monotonic() - conn.last_used
+
+        if idle > self.max_idle:
+            return False
+
+        if idle <= self.noop_after:
+            return True
+
+        try:
+            return conn.smtp.noop()[0] == 250
+
+        except smtplib.SMTPException:
+            return False
+
+        except OSError:
+            return False
+
+    def acquire(self) -> PooledConnection:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+
+            except queue.Empty:
+                return self._open()
+
+            if self._is_alive(conn):
+                with self._lock:
+                    self.reused += 1
+
+                return conn
+
+            conn.close()
+
+    def release(self, conn: PooledConnection):
+        conn.sent += 1
+        conn.last_used = time.monotonic()
+
+        if conn.sent >= self.max_messages or self._idle.qsize() >= self.size:
+            conn.close()
+            return
+
+        self._idle.put(conn)
+
+    def sendmail(self, from_addr: str, to_addrs, msg: str):
+        with self._slots:
+            self._sendmail(from_addr, to_addrs, msg)
+
+    def _sendmail(self, from_addr: str, to_addrs, msg: str):
+        conn = self.acquire()
+
+        try:
+            deliver(conn.smtp, from_addr, to_addrs, msg)
+
+        # SMTPException is an OSError too, a message the server refuses must not be sent again
+        except (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout) as e:
+            conn.close()
+
+            logger.warn(f"SMTP connection dropped, reconnecting - {e}")
+
+            conn = self._open()
+
+            try:
+                deliver(conn.smtp, from_addr, to_addrs, msg)
+
+            except Exception:
+                conn.close()
+                raise
+
+        except Exception:
+            # the server refused the message, or the connection was lost once it had it, either
+            # way the connection itself may be unusable
+            conn.close()
+            raise
+
+        self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+
+            except queue.Empty:
+                return
+
+    def stats(self) -> dict:
+        return {
+            "name": "smtp",
+            "idle": self._idle.qsize(),
+            "connects": self.connects,
+            "reused": self.reused,
+        }
+
+
+smtp_pool = SMTPPool(size=settings.smtp_pool_size, max_messages=settings.smtp_max_messages_per_connection,
+                     noop_after=settings.smtp_noop_after_secs, max_idle=settings.smtp_max_idle_secs)
@@ -1,10 +1,35 @@
-from huey import SqliteHuey
+from huey import Huey, SqliteHuey
 from ..config.settings import get_settings
+from .storage import MongoStorage
 
 
 settings = get_settings()
 
-huey = SqliteHuey(filename="./huey.db")
+
+def create_queue(name: str) -> Huey:
+    if settings.huey_backend == "mongo":
+        return Huey(name, storage_class=MongoStorage,
+                    url=settings.db_url, db_name=settings.db_name)
+
+    return SqliteHuey(name, filename="./huey.db")
+
+
+# one queue per class of task, each drained by its own consumer pool (see consumers.py) so that
+# slow emails and KYC lookups never hold up the cheap tasks behind them
+huey = create_queue("safehome")
+email_huey = create_queue("safehome-email")
+kyc_huey = create_queue("safehome-kyc")
+
+QUEUES = {
+    "default": huey,
+    "email": email_huey,
+    "kyc": kyc_huey,
+}
+
+# task priorities within a queue, higher runs first
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
 
 # if settings.debug:
 #     huey.immediate = True
@@ -0,0 +1,123 @@
+""" Runs a huey consumer for each queue in QUEUES, each in its own process with its own pool of
+huey_<queue>_workers workers of huey_<queue>_worker_type ("thread", "greenlet" or "process").
+
+    python -m libs.huey_tasks.consumers [queue ...]
+
+A consumer that exits is restarted. SIGTERM and SIGINT stop them all: each consumer is sent
+SIGINT, so that huey finishes the running tasks and runs its shutdown hooks, and is terminated if it
+has not exited STOP_TIMEOUT_SECS later.
+"""
+
+import os
+import sys
+import time
+import signal
+import threading
+import logging
+import importlib
+import multiprocessing
+from huey.consumer_options import ConsumerConfig
+from libs.config.settings import get_settings
+from libs.logging import Logger
+
+
+settings = get_settings()
+
+logger = Logger(f"{__package__}.{__name__}")
+
+RESTART_DELAY_SECS = 5
+STOP_TIMEOUT_SECS = 60
+
+
+def run_consumer(name: str):
+    # its own process group, so that a ^C in the terminal reaches only main(), which passes it on once
+    os.setpgrp()
+
+    workers = getattr(settings, f"huey_{name}_workers")
+    worker_type = getattr(settings, f"huey_{name}_worker_type")
+
+    if worker_type == "greenlet":
+        # gevent has to patch the standard library before anything that uses it is imported
+        from gevent import monkey
+        monkey.patch_all()
+
+    # registers every task on its queue
+    importlib.import_module("main")
+
+    from .config import QUEUES
+
+    # -q -f, as the consumers were started before
+    config = ConsumerConfig(workers=workers, worker_type=worker_type,
+                            flush_locks=True, verbose=False)
+    config.validate()
+    config.setup_logger(logging.getLogger("huey"))
+
+    QUEUES[name].create_consumer(**config.values).run()
+
+
+def main(names: list[str] | None = None):
+    from .config import QUEUES
+
+    names = names or list(QUEUES)
+
+    for name in names:
+        if name not in QUEUES:
+            raise ValueError(
+                f"Unknown queue {name}, expected one of {list(QUEUES)}")
+
+    # spawned rather than forked, so that no connection or lock of this process leaks into them
+    context = multiprocessing.get_context("spawn")
+    processes: dict[str, multiprocessing.Process] = {}
+    stopping = threading.Event()
+
+    def start(name: str):
+        process = context.Process(target=run_consumer, args=(
+            name,), name=f"huey-{name}", daemon=False)
+        process.start()
+        processes[name] = process
+
+        logger.info(
+            f"Started {name} queue consumer (pid {process.pid}) with {getattr(settings, f'huey_{name}_workers')} {getattr(settings, f'huey_{name}_worker_type')} workers")
+
+    def stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for name in names:
+        start(name)
+
+    while not stopping.wait(1):
+
+        for name, process in list(processes.items()):
+            if process.is_alive():
+                continue
+
+            logger.error(
+                f"{name} queue consumer exited with {process.exitcode}, restarting in {RESTART_DELAY_SECS}s")
+
+            # a stop signal during the delay must not start a consumer nothing would stop
+            if stopping.wait(RESTART_DELAY_SECS):
+                break
+
+            start(name)
+
+    for process in processes.values():
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGINT)
+
+    deadline = time.monotonic() + STOP_TIMEOUT_SECS
+
+    for name, process in processes.items():
+        process.join(max(0, deadline - time.monotonic()))
+
+        if process.is_alive():
+            logger.error(
+                f"{name} queue consumer did not stop within {STOP_TIMEOUT_SECS}s, terminating it")
+            process.terminate()
+            process.join()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,265 @@
+""" Per task instrumentation of the huey consumers, recorded from huey's signals.
+
+Each consumer process counts outcomes and retries and builds histograms of run time and of queue
+lag (enqueue to start, only known on the MongoDB backend) per task name, and adds them to hourly
+documents in task_metrics every task_metrics_flush_secs. Tasks declared with retries that fail with
+none left are stored in task_dead_letters; periodic tasks and tasks without retries, which fail
+again on their next run or call, are only counted. Both collections expire through TTL indexes.
+
+    python -m libs.huey_tasks.metrics [hours]
+"""
+
+import sys
+import json
+import time
+import threading
+import traceback
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from huey import Huey
+from huey.api import PeriodicTask
+from huey import signals as S
+from pymongo import MongoClient, UpdateOne
+from pymongo.database import Database
+from libs.config.settings import get_settings
+from libs.db import Collections
+from libs.logging import Logger
+from models.tasks import DeadLetterTask
+
+
+settings = get_settings()
+
+logger = Logger(f"{__package__}.{__name__}")
+
+# upper bounds in seconds of the run time and lag histogram buckets, the last one catches the rest
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, float("inf"))
+
+OUTCOMES = {
+    S.SIGNAL_COMPLETE: "complete",
+    S.SIGNAL_ERROR: "error",
+    S.SIGNAL_RETRYING: "retrying",
+    S.SIGNAL_CANCELED: "canceled",
+    S.SIGNAL_LOCKED: "locked",
+    S.SIGNAL_EXPIRED: "expired",
+    S.SIGNAL_REVOKED: "revoked",
+    S.SIGNAL_INTERRUPTED: "interrupted",
+}
+
+# outcomes that end a run, and so its run time
+FINISHED = {S.SIGNAL_COMPLETE, S.SIGNAL_ERROR,
+            S.SIGNAL_CANCELED, S.SIGNAL_LOCKED, S.SIGNAL_INTERRUPTED}
+
+
+def bucket(seconds: float) -> int:
+    return next(i for i, bound in enumerate(BUCKETS) if seconds <= bound)
+
+
+class TaskMetrics:
+    "Aggregates task signals in memory and adds them to the task_metrics collection in bulk"
+
+    def __init__(self, flush_interval: float, db: Database | None = None) -> None:
+        self.flush_interval = flush_interval
+        self._db = db
+        self._pending: dict[tuple[str, int], Counter] = {}
+        self._lock = threading.Lock()
+        self._started = threading.local()
+        self._thread: threading.Thread | None = None
+        self._stopping = threading.Event()
+
+    def get_db(self) -> Database:
+        if self._db is None:
+            self._db = MongoClient(settings.db_url)[settings.db_name]
+
+        return self._db
+
+    def record(self, task_name: str, counts: dict[str, float]):
+        hour = int(time.time() // 3600 * 3600)
+
+        with self._lock:
+            self._pending.setdefault((task_name, hour), Counter()).update(counts)
+
+        self.start()
+
+    def _observe(self, kind: str, seconds: float) -> dict[str, float]:
+        return {f"{kind}.count": 1, f"{kind}.sum": seconds, f"{kind}.b{bucket(seconds)}": 1}
+
+    def on_signal(self, queue: Huey, signal: str, task, *args):
+        counts = {}
+
+        if signal == S.SIGNAL_EXECUTING:
+            self._started.run = (task.id, time.monotonic())
+
+            last_enqueued_at = getattr(
+                queue.storage, "last_enqueued_at", None)
+            enqueued_at = last_enqueued_at() if last_enqueued_at else None
+
+            if enqueued_at is not None:
+                counts.update(self._observe(
+                    "lag", max(0, time.time() - enqueued_at)))
+
+        if signal in OUTCOMES:
+            counts[f"outcomes.{OUTCOMES[signal]}"] = 1
+
+        if signal in FINISHED:
+            task_id, started = getattr(self._started, "run", (None, None))
+
+            if task_id == task.id:
+                counts.update(self._observe(
+                    "runtime", time.monotonic() - started))
+
+        if signal == S.SIGNAL_ERROR and not task.retries and task.default_retries and not isinstance(task, PeriodicTask):
+            counts["outcomes.dead"] = 1
+            self.dead_letter(queue, task, args[0] if args else None)
+
+        if counts:
+            self.record(task.name, counts)
+
+    def dead_letter(self, queue: Huey, task, exc: Exception | None):
+        # context tasks get the task itself as a keyword argument
+        kwargs = {key: value for key, value in task.kwargs.items()
+                  if key != "task"}
+
+        entry = DeadLetterTask(
+            task_id=task.id, task_name=task.name, queue=queue.name, args=repr(task.args), kwargs=repr(kwargs),
+            error=repr(exc) if exc is not None else "",
+            traceback="".join(traceback.format_exception(exc)) if exc is not None else "")
+
+        try:
+            self.get_db()[Collections.task_dead_letters].insert_one(
+                entry.model_dump())
+
+        except Exception as e:
+            logger.error(
+                f"Unable to store dead letter for {task.name} {task.id} - {e}")
+
+        logger.error(
+            f"Task {task.name} {task.id} failed with no retries left - {entry.error}")
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return
+
+        retention = timedelta(days=settings.task_metrics_retention_days)
+
+        ops = [UpdateOne({"task_name": task_name, "hour": hour}, {"$inc": dict(counts), "$setOnInsert": {
+            "expires_at": datetime.fromtimestamp(hour, tz=timezone.utc) + retention}}, upsert=True)
+            for (task_name, hour), counts in pending.items()]
+
+        try:
+            self.get_db()[Collections.task_metrics].bulk_write(
+                ops, ordered=False)
+
+        except Exception as e:
+            logger.error(
+                f"Unable to flush metrics of {len(ops)} tasks, will retry - {e}")
+
+            # put them back so that they are added on the next flush
+            with self._lock:
+                for key, counts in pending.items():
+                    self._pending.setdefault(key, Counter()).update(counts)
+
+    def run(self):
+        while not self._stopping.wait(self.flush_interval):
+            self.flush()
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._stopping.clear()
+                self._thread = threading.Thread(
+                    target=self.run, name="task-metrics", daemon=True)
+                self._thread.start()
+
+
+task_metrics = TaskMetrics(settings.task_metrics_flush_secs)
+
+
+def instrument(queue: Huey):
+    "Record the signals of every task of the queue"
+
+    @queue.signal()
+    def record_task_signal(signal, task, *args):
+        task_metrics.on_signal(queue, signal, task, *args)
+
+    @queue.on_shutdown()
+    def flush_task_metrics():
+        task_metrics.flush()
+
+
+def _summary(hist: dict[str, float]) -> dict:
+    "Count, mean and approximate percentiles (bucket upper bounds) of a histogram"
+
+    count = hist.get("count", 0)
+
+    if not count:
+        return {"count": 0}
+
+    def percentile(p: float):
+        target = p * count
+        seen = 0
+
+        for i, bound in enumerate(BUCKETS):
+            seen += hist.get(f"b{i}", 0)
+
+            if seen >= target:
+                return bound if bound != float("inf") else f">{BUCKETS[-2]}"
+
+    return {
+        "count": count,
+        "mean": round(hist.get("sum", 0) / count, 4),
+        "p50": percentile(0.5),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+    }
+
+
+def task_report(db: Database, queues: dict[str, Huey], hours: int = 24) -> dict:
+    "Outcomes, retries, run time and lag per task over the last `hours`, queue depths and dead letters"
+
+    since = time.time() - hours * 3600
+    tasks: dict[str, dict] = {}
+
+    for doc in db[Collections.task_metrics].find({"hour": {"$gte": since // 3600 * 3600}}):
+        totals = tasks.setdefault(
+            doc["task_name"], {"outcomes": Counter(), "runtime": Counter(), "lag": Counter()})
+
+        for field in totals:
+            totals[field].update(doc.get(field, {}))
+
+    report = {
+        "hours": hours,
+        "queues": {name: {"pending": queue.pending_count(), "scheduled": queue.scheduled_count()}
+                   for name, queue in queues.items()},
+        "tasks": {
+            task_name: {
+                "outcomes": dict(totals["outcomes"]),
+                "retries": totals["outcomes"].get("retrying", 0),
+                "runtime": _summary(totals["runtime"]),
+                "lag": _summary(totals["lag"]),
+            }
+            for task_name, totals in sorted(tasks.items())
+        },
+        "dead_letters": {
+            row["_id"]: row["count"] for row in db[Collections.task_dead_letters].aggregate([
+                {"$match": {"failed_at": {"$gte": since}}},
+                {"$group": {"_id": "$task_name", "count": {"$sum": 1}}},
+            ])
+        },
+    }
+
+    return report
+
+
+if __name__ == "__main__":
+    from .config import QUEUES
+
+    args = sys.argv[1:]
+
+    print(json.dumps(task_report(task_metrics.get_db(), QUEUES,
+          int(args[0]) if args else settings.task_metrics_report_hours), indent=2, default=str))
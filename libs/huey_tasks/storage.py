@@ -0,0 +1,171 @@
+import time
+import threading
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+from huey.constants import EmptyData
+from huey.storage import BaseStorage
+from huey.utils import to_timestamp
+
+
+class MongoStorage(BaseStorage):
+    """ Huey storage on MongoDB, so that every web and consumer process on every host shares one
+    queue without a file lock.
+
+    Tasks, the schedule and the key/value store (results, locks, revocations) are one collection
+    each, shared by all queues and keyed by queue name. Every read that consumes data is a single
+    find_one_and_delete, so concurrent consumers never receive the same task twice.
+
+    Tasks are stamped with the time they were enqueued, which last_enqueued_at() hands to the
+    worker thread that dequeued them, for queue lag metrics.
+    """
+
+    def __init__(self, name="huey", url="mongodb://localhost:27017", db_name="huey", collection_prefix="huey", client=None, **kwargs):
+        super(MongoStorage, self).__init__(name)
+
+        self.client = client or MongoClient(url, **kwargs)
+        self.db = self.client[db_name]
+
+        self.tasks = self.db[f"{collection_prefix}_tasks"]
+        self.schedule = self.db[f"{collection_prefix}_schedule"]
+        self.kv = self.db[f"{collection_prefix}_kv"]
+
+        self._indexed = False
+        self._dequeued = threading.local()
+
+    def _ensure_indexes(self):
+        # created on first use rather than at import, so that importing the app needs no connection
+        if self._indexed:
+            return
+
+        self.tasks.create_index(
+            [("queue", ASCENDING), ("priority", DESCENDING), ("_id", ASCENDING)])
+        self.schedule.create_index([("queue", ASCENDING), ("ts", ASCENDING)])
+        self.kv.create_index(
+            [("queue", ASCENDING), ("key", ASCENDING)], unique=True)
+
+        self._indexed = True
+
+    def close(self):
+        self.client.close()
+
+    def enqueue(self, data, priority=None):
+        self._ensure_indexes()
+        self.tasks.insert_one(
+            {"queue": self.name, "data": data, "priority": priority or 0, "enqueued_at": time.time()})
+
+    def enqueue_many(self, items):
+        "Enqueue (data, priority) pairs in one round trip, keeping their order"
+
+        self._ensure_indexes()
+        now = time.time()
+        self.tasks.insert_many([{"queue": self.name, "data": data, "priority": priority or 0, "enqueued_at": now}
+                                for data, priority in items])
+
+    def dequeue(self):
+        self._ensure_indexes()
+
+        doc = self.tasks.find_one_and_delete(
+            {"queue": self.name}, sort=[("priority", DESCENDING), ("_id", ASCENDING)])
+
+        if doc is None:
+            return None
+
+        self._dequeued.enqueued_at = doc.get("enqueued_at", None)
+
+        return doc["data"]
+
+    def last_enqueued_at(self):
+        "When the task this thread last dequeued was enqueued, cleared once read"
+
+        enqueued_at = getattr(self._dequeued, "enqueued_at", None)
+        self._dequeued.enqueued_at = None
+
+        return enqueued_at
+
+    def queue_size(self):
+        return self.tasks.count_documents({"queue": self.name})
+
+    def enqueued_items(self, limit=None):
+        cursor = self.tasks.find({"queue": self.name}, {"data": 1}).sort(
+            [("priority", DESCENDING), ("_id", ASCENDING)])
+
+        if limit is not None:
+            cursor = cursor.limit(limit)
+
+        return [doc["data"] for doc in cursor]
+
+    def flush_queue(self):
+        self.tasks.delete_many({"queue": self.name})
+
+    def add_to_schedule(self, data, ts, utc):
+        self._ensure_indexes()
+        self.schedule.insert_one(
+            {"queue": self.name, "data": data, "ts": to_timestamp(ts)})
+
+    def read_schedule(self, ts):
+        self._ensure_indexes()
+
+        query = {"queue": self.name, "ts": {"$lte": to_timestamp(ts)}}
+        data = []
+
+        # claimed one at a time so that schedulers on several hosts never both run a task
+        while True:
+            doc = self.schedule.find_one_and_delete(
+                query, sort=[("ts", ASCENDING)])
+
+            if doc is None:
+                return data
+
+            data.append(doc["data"])
+
+    def schedule_size(self):
+        return self.schedule.count_documents({"queue": self.name})
+
+    def scheduled_items(self, limit=None):
+        cursor = self.schedule.find({"queue": self.name}, {
+                                    "data": 1}).sort("ts", ASCENDING)
+
+        if limit is not None:
+            cursor = cursor.limit(limit)
+
+        return [doc["data"] for doc in cursor]
+
+    def flush_schedule(self):
+        self.schedule.delete_many({"queue": self.name})
+
+    def put_data(self, key, value, is_result=False):
+        self._ensure_indexes()
+        self.kv.update_one({"queue": self.name, "key": key}, {
+                           "$set": {"value": value, "is_result": is_result}}, upsert=True)
+
+    def peek_data(self, key):
+        doc = self.kv.find_one({"queue": self.name, "key": key})
+        return doc["value"] if doc is not None else EmptyData
+
+    def pop_data(self, key):
+        doc = self.kv.find_one_and_delete({"queue": self.name, "key": key})
+        return doc["value"] if doc is not None else EmptyData
+
+    def has_data_for_key(self, key):
+        return self.kv.count_documents({"queue": self.name, "key": key}, limit=1) > 0
+
+    def put_if_empty(self, key, value):
+        self._ensure_indexes()
+
+        try:
+            self.kv.insert_one(
+                {"queue": self.name, "key": key, "value": value, "is_result": False})
+
+        except DuplicateKeyError:
+            return False
+
+        return True
+
+    def result_store_size(self):
+        return self.kv.count_documents({"queue": self.name})
+
+    def result_items(self):
+        return {doc["key"]: doc["value"] for doc in self.kv.find({"queue": self.name})}
+
+    def flush_results(self):
+        self.kv.delete_many({"queue": self.name})
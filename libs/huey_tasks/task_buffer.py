@@ -0,0 +1,149 @@
+import time
+import queue
+import threading
+from huey.api import TaskWrapper
+from libs.config.settings import get_settings
+from libs.logging import Logger
+
+
+settings = get_settings()
+
+logger = Logger(f"{__package__}.{__name__}")
+
+
+class TaskBuffer:
+    """ Takes task submissions from async route handlers without touching the task store, and
+    writes them to huey's storage in batches from a background thread.
+
+    Each task goes to the queue it was declared on. Until start() is called (scripts, the consumer
+    itself) and once the buffer holds max_pending tasks, submit() enqueues directly, so nothing is
+    ever dropped for want of a writer.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_pending: int, retry_interval: float) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retry_interval = retry_interval
+        self.written = 0
+        self.batches = 0
+        self.direct = 0
+        self.failures = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._stopping = threading.Event()
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def submit(self, task: TaskWrapper, *args, **kwargs) -> str:
+        "Queue a call of the task with the given arguments, returning the id of the huey task"
+
+        instance = task.s(*args, **kwargs)
+
+        if self._thread is None or task.huey.immediate or len(self) >= self.max_pending:
+            self.direct += 1
+            task.huey.enqueue(instance)
+        else:
+            self._queue.put((task.huey, instance))
+
+        return instance.id
+
+    def _take_batch(self, timeout: float) -> list:
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _write(self, batch: list):
+        by_queue = {}
+
+        for target, instance in batch:
+            if instance.expires:
+                instance.resolve_expires(target.utc)
+
+            by_queue.setdefault(target, []).append(
+                (target.serialize_task(instance), instance.priority))
+
+        for target, items in by_queue.items():
+            if hasattr(target.storage, "enqueue_many"):
+                target.storage.enqueue_many(items)
+            else:
+                for data, priority in items:
+                    target.storage.enqueue(data, priority)
+
+            # so that a retry after a later queue fails does not enqueue these twice
+            batch[:] = [entry for entry in batch if entry[0] is not target]
+            self.written += len(items)
+
+        self.batches += 1
+
+    def _write_until_stored(self, batch: list):
+        last_attempt = False
+
+        while True:
+            try:
+                self._write(batch)
+                return
+
+            except Exception as e:
+                self.failures += 1
+
+                if last_attempt:
+                    logger.error(
+                        f"Unable to enqueue {len(batch)} buffered tasks on shutdown, dropping {[instance.name for _, instance in batch]} - {e}")
+                    return
+
+                logger.error(
+                    f"Unable to enqueue {len(batch)} buffered tasks, will retry - {e}")
+                # once stopping, a batch gets one more attempt before it is given up
+                last_attempt = self._stopping.is_set()
+                time.sleep(self.retry_interval)
+
+    def run(self):
+        while not self._stopping.is_set():
+            batch = self._take_batch(self.flush_interval)
+
+            if batch:
+                self._write_until_stored(batch)
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self.run, name="huey-task-buffer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        "Stop the writer and flush whatever is still buffered"
+
+        if self._thread is None:
+            return
+
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+        while batch := self._take_batch(0):
+            self._write_until_stored(batch)
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self),
+            "written": self.written,
+            "batches": self.batches,
+            "direct": self.direct,
+            "failures": self.failures,
+        }
+
+
+task_buffer = TaskBuffer(settings.task_buffer_batch_size, settings.task_buffer_flush_secs,
+                         settings.task_buffer_max_pending, settings.task_buffer_retry_secs)
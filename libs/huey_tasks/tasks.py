@@ -1,4 +1,4 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 from pydantic import EmailStr
 from libs.utils.pure_functions import get_utc_timestamp
 from libs.config.settings import get_settings
@@ -7,17 +7,27 @@ from libs.db import Collections
 from models.wallets import Wallet
 from models.referrals import Referral, UserReferralProfile
 from models.affiliates import AffiliateProfile, AffiliateReferral
-from huey.exceptions import CancelExecution
+from huey.exceptions import CancelExecution, TaskLockedException
 from huey import crontab
 from models.notifications import Notification, NotificationTypes
+from models.payments import Transaction, TransactionStatus, TransactionType, TransactionDirection, PaymentEvent, PaymentEventStatus
 from .utils import exp_backoff_task
-from .config import huey
-from libs.emails.send_email import dispatch_email
+from .task_buffer import task_buffer
+from .metrics import instrument
+from .config import huey, email_huey, kyc_huey, QUEUES, PRIORITY_HIGH, PRIORITY_LOW
+from libs.emails.outbox import DomainRateLimiter, drain_outbox, recipient_domain
+from libs.emails.render_template import precompile_templates
+from models.emails import OutboxEmail
 from libs.utils.req_helpers import make_req, make_url, Endpoints, handle_response2
 from models.users import UserDBModel, KYCDocumentType, KYCStatus
 from libs.utils.security import decrypt
+from libs.utils.qoreid import quore_id_token, verify_identity
+from libs.utils.notification_sink import notification_sink
 from datetime import datetime
 import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 
 logger = Logger(f"{__package__}.{__name__}")
@@ -31,37 +41,6 @@ db = client[settings.db_name]
 OTP_TYPE = "otp"
 
 
-def load_quore_id_api_token():
-
-    token = None
-
-    url = make_url(settings.quore_id_api_url, "/token")
-
-    ok, status, data = make_req(
-        url, "POST", {
-            'Content-Type': 'application/json'
-        }, {
-            "clientId":  settings.quore_id_client_id,
-            "secret": settings.quore_id_secret_key
-        }
-    )
-
-    success = handle_response2(ok, status, data)
-
-    if not success:
-        logger.critical("\n Failed to get QUORE ID TOKEN ")
-
-    else:
-
-        token = data["accessToken"]
-        logger.info("\n Fetched QUORE ID TOKEN successfully ")
-
-        if settings.debug:
-            print("Quore ID Details: ", data)
-
-    return token
-
-
 @huey.task(retries=3,  retry_delay=20, name="task_test_huey")
 def task_test_huey():
 
@@ -247,7 +226,7 @@ def task_process_referral_code(user_id:  str, referralCode: str):
 
 
 # Task to execute  additional actions after a successful user registration
-@exp_backoff_task(retries=3, retry_backoff=1.15, retry_delay=45)
+@exp_backoff_task(retries=3, retry_backoff=1.15, retry_delay=45, priority=PRIORITY_HIGH)
 def task_post_user_registration(user_id:  str):
 
     logger.info(f"Executing post-registration actions for user {user_id}")
@@ -275,56 +254,100 @@ def task_post_user_registration(user_id:  str):
 
 # Task to create a notification for a user
 
-@exp_backoff_task(retries=3, retry_backoff=1.15, retry_delay=15)
-def task_create_notification(user_id:  str, notification_type:  NotificationTypes,  title:  str, body:  str, ):
+@exp_backoff_task(retries=3, retry_backoff=1.15, retry_delay=15, priority=PRIORITY_LOW, context=True)
+def task_create_notification(user_id:  str, notification_type:  NotificationTypes,  title:  str, body:  str, dedupe_key: str | None = None, task=None):
+    "Stores notifications that overflowed notification_sink, and tasks queued before it existed"
 
-    logger.info(
-        f"Creating notification of type {notification_type} for user {user_id}")
+    # a retry keeps the task id, so it cannot store the notification a second time
+    notification_sink.add(user_id, notification_type,
+                          title, body, dedupe_key=dedupe_key or f"task:{task.id}", wait=True)
 
-    user = db[Collections.users].find_one({"uid": user_id})
 
-    if not user:
-        logger.info(f"User {user_id} does not exist")
-        raise CancelExecution(retry=False)
+def overflow_notification(notification: Notification):
+    task_buffer.submit(task_create_notification, notification.user_id, notification.notification_type,
+                       notification.title, notification.body, dedupe_key=notification.dedupe_key)
 
-    # Create the notification
 
-    notification = Notification(
-        user_id=user_id, notification_type=notification_type, title=title, body=body)
+notification_sink.overflow = overflow_notification
 
-    db[Collections.notifications].insert_one(notification.model_dump())
+
+def flush_notifications():
+    notification_sink.flush()
+
+
+for queue in QUEUES.values():
+    queue.on_shutdown()(flush_notifications)
+    instrument(queue)
 
 
 # Task to send an email
 
-@exp_backoff_task(retries=3, retry_backoff=1.15, retry_delay=45)
+email_rate_limiter = DomainRateLimiter(
+    settings.email_domain_rate_per_sec, settings.email_domain_rate_overrides)
+
+
+def drain_email_outbox():
+
+    # one drainer at a time; a message appended while another worker drains is picked up by it
+    try:
+        with email_huey.lock_task("email-outbox"):
+            return drain_outbox(db[Collections.email_outbox], email_rate_limiter)
+
+    except TaskLockedException:
+        return None
+
+
+@exp_backoff_task(retries=3, retry_backoff=1.15, retry_delay=45, queue=email_huey)
 def task_send_mail(email_type:  str, email_to:  EmailStr | list[EmailStr], email_data:  dict):
 
-    logger.info(f"Sending email of type {email_type} to {email_to}")
+    logger.info(f"Queueing email of type {email_type} to {email_to}")
+
+    email = OutboxEmail(email_type=email_type, email_to=email_to,
+                        email_data=email_data, domain=recipient_domain(email_to))
+
+    db[Collections.email_outbox].insert_one(email.model_dump())
+
+    # the message is stored, so a failed drain must not retry this task and append it again;
+    # task_drain_email_outbox sends it on its next run
+    try:
+        drain_email_outbox()
+
+    except Exception as e:
+        logger.error(
+            f"Unable to drain the email outbox after queueing {email.uid} - {e}")
+
 
-    dispatch_email(email_to, email_type, email_data)
+@email_huey.on_startup()
+def compile_email_templates():
+    precompile_templates()
+
+
+# Picks up messages left behind by a drain that ended as they were appended, and due retries
+@email_huey.periodic_task(crontab(minute="*"), name="task_drain_email_outbox")
+def task_drain_email_outbox():
+    drain_email_outbox()
 
 
 # Task to initiate kyc verification
 
-@exp_backoff_task(retries=3, retry_backoff=1.15, retry_delay=45)
+@exp_backoff_task(retries=3, retry_backoff=1.15, retry_delay=45, queue=kyc_huey)
 def task_initiate_kyc_verification(user_id:  str):
 
     user = db[Collections.users].find_one({"uid": user_id})
 
-    # Update the user's kyc status
-    db[Collections.users].update_one(
-        {"uid": user_id}, {"$set": {"kyc_status": KYCStatus.APPROVED}})
+    if settings.kyc_auto_approve:
 
-    # Send an email to the user
-    task_send_mail("kyc_approved", user["email"], {
-        "first_name": user["first_name"], })
+        # Update the user's kyc status
+        db[Collections.users].update_one(
+            {"uid": user_id}, {"$set": {"kyc_status": KYCStatus.APPROVED}})
 
-    return
+        # Send an email to the user
+        task_send_mail("kyc_approved", user["email"], {
+            "first_name": user["first_name"], })
 
-    quore_id_api_token = load_quore_id_api_token()
+        return
 
-    if quore_id_api_token is None:
+    if quore_id_token.get() is None:
         logger.critical(f"QUORE ID TOKEN is not ready!!!")
         raise CancelExecution(retry=False)
 
@@ -346,12 +369,15 @@ def task_initiate_kyc_verification(user_id:  str):
         logger.info(f"User {user_id} has not been marked for KYC verification")
         raise CancelExecution(retry=False)
 
-    approved = False
-    failure_reason = ""
+    started = time.monotonic()
 
     decrypted_bvn = decrypt(bytes.fromhex(user_db.kyc_info.BVN)).decode()
+    decrypted_nin = decrypt(bytes.fromhex(
+        user_db.kyc_info.IDNumber)).decode()
+
+    decrypt_time = round(time.monotonic() - started, 3)
 
-    body = {
+    bvn_body = {
         "firstname": user_db.first_name,
         "lastname": user_db.last_name,
         "dob": dob,
@@ -359,182 +385,512 @@ def task_initiate_kyc_verification(user_id:  str):
         "phone": user_db.phone,
     }
 
-    url = make_url(Endpoints.bvn_verification.value,
-                   surfix=f"/{decrypted_bvn}")
+    nin_body = {
+        "firstname": user_db.first_name,
+        "lastname": user_db.last_name,
+        "dob": dob,
+        "gender":  user_db.gender
 
-    # Make the request to the KYC API
-    ok, status, data = make_req(
-        method="POST", url=url, body=body, headers={
-            "Authorization": f"Bearer {quore_id_api_token}"
-        })
+    }
 
-    success = handle_response2(ok, status, data)
+    # Look up the BVN and NIN together; the NIN result is dropped if the BVN lookup failed and a missed deadline is retried by huey
+    result = verify_identity(decrypted_bvn, bvn_body, decrypted_nin,
+                             nin_body, settings.kyc_verification_deadline_secs)
 
-    if not success:
+    logger.info(
+        f"KYC lookups for user {user_id} took {round(time.monotonic() - started, 3)}s - decrypt {decrypt_time}s {result['timings']}")
 
-        reason = str(data) if type(data) != "str" else data
+    for stage, retry in [("bvn", True), ("nin", False)]:
 
-        try:
-            t = json.loads(reason)
-            reason = t["message"]
+        ok, status, data = result[stage]
 
-        except:
-            pass
+        success = handle_response2(ok, status, data)
 
-        # Update the user's kyc status
-        db[Collections.users].update_one(
-            {"uid": user_id}, {"$set": {"kyc_status": KYCStatus.REJECTED}})
+        if not success:
 
-        # Send an email to the user
-        task_send_mail("kyc_rejected", user["email"], {
-            "first_name": user["first_name"], "reason":  reason})
+            reason = str(data) if type(data) != "str" else data
 
-        logger.info(
-            f"KYC verification request for user {user_id} failed - {ok} {status} {data}")
+            try:
+                t = json.loads(reason)
+                reason = t["message"]
 
-        raise CancelExecution(retry=True)
+            except:
+                pass
 
-    bvn_summary = data["summary"]
-    # bvn_status = bvn_summary["status"]
+            # Update the user's kyc status
+            db[Collections.users].update_one(
+                {"uid": user_id}, {"$set": {"kyc_status": KYCStatus.REJECTED}})
 
-    field_matches = bvn_summary["bvn_match_check"]["fieldMatches"]
+            # Send an email to the user
+            task_send_mail("kyc_rejected", user["email"], {
+                "first_name": user["first_name"], "reason":  reason})
+
+            logger.info(
+                f"KYC verification request for user {user_id} failed - {ok} {status} {data}")
 
-    unmatched_fields = []
+            raise CancelExecution(retry=retry)
 
-    if not field_matches.get("firstname", None):
-        unmatched_fields.append("First Name")
+    bvn_matches = result["bvn"][2]["summary"]["bvn_match_check"]["fieldMatches"]
+    nin_matches = result["nin"][2]["summary"]["nin_check"]["fieldMatches"]
 
-    if not field_matches.get("lastname", None):
-        unmatched_fields.append("Last Name")
+    bvn_unmatched = [label for field, label in [("firstname", "First Name"), ("lastname", "Last Name")]
+                     if not bvn_matches.get(field, None)]
 
-    if len(unmatched_fields) > 0:
+    nin_unmatched = [label for field, label in [("firstname", "First Name"), ("lastname", "Last Name"), ("gender", "Gender")]
+                     if not nin_matches.get(field, None)]
 
-        reason = "The details you provided do not match the details on your BVN. The following fields do not match: " + \
-            ", ".join(unmatched_fields)
+    if "dob" in nin_matches and not nin_matches["dob"]:
+        nin_unmatched.append("Date of Birth")
+
+    failure_reason = ""
+
+    if len(bvn_unmatched) > 0:
+        failure_reason = "The details you provided do not match the details on your BVN. The following fields do not match: " + \
+            ", ".join(bvn_unmatched)
+
+    if len(nin_unmatched) > 0:
+
+        reason = "1. The details you provided do not match the details on your NIN. The following fields do not match: " + \
+            ", ".join(nin_unmatched)
+
+        if failure_reason:
+
+            reason += f"   2. {failure_reason}"
 
         failure_reason = reason
 
-        # # Update the user's kyc status
-        # db[Collections.users].update_one(
-        #     {"uid": user_id}, {"$set": {"kyc_status": KYCStatus.REJECTED}})
+    if failure_reason:
+
+        # Update the user's kyc status
+        db[Collections.users].update_one(
+            {"uid": user_id}, {"$set": {"kyc_status": KYCStatus.REJECTED}})
 
-        # # Send an email to the user
-        # task_send_mail("kyc_rejected", user["email"], {
-        #     "first_name": user["first_name"], "reason":  reason})
+        # Send an email to the user
+        task_send_mail("kyc_rejected", user["email"], {
+            "first_name": user["first_name"], "reason":  failure_reason})
 
     else:
 
-        approved = True
+        # Update the user's kyc status
+        db[Collections.users].update_one(
+            {"uid": user_id}, {"$set": {"kyc_status": KYCStatus.APPROVED}})
+
+        # Send an email to the user
+        task_send_mail("kyc_approved", user["email"], {
+            "first_name": user["first_name"], })
 
-        # # Update the user's kyc status
-        # db[Collections.users].update_one(
-        #     {"uid": user_id}, {"$set": {"kyc_status": KYCStatus.APPROVED}})
 
-        # # Send an email to the user
-        # task_send_mail("kyc_approved", user["email"], {
-        #     "first_name": user["first_name"], })
+# Payment completion, shared by the flutterwave webhook and the redirect handlers
 
-    decrypted_nin = decrypt(bytes.fromhex(
-        user_db.kyc_info.IDNumber)).decode()
+COMPLETABLE_TX_TYPES = [TransactionType.topup, TransactionType.membership_fee, TransactionType.investment,
+                        TransactionType.savings_add_funds, TransactionType.locked_savings_add_funds]
 
-    body = {
-        "firstname": user_db.first_name,
-        "lastname": user_db.last_name,
-        "dob": dob,
-        "gender":  user_db.gender
 
-    }
+def verify_flutterwave_transaction(tx_id: str):
 
-    url = make_url(Endpoints.nin_verification.value,
-                   surfix=f"/{decrypted_nin}")
+    url = make_url(
+        f"{Endpoints.flutterwave_tx_verification.value}/{tx_id}/verify")
 
-    # Make the request to the KYC API
     ok, status, data = make_req(
-        url, "POST",  body=body, headers={
-            "Authorization": f"Bearer {quore_id_api_token}"
-        })
+        url, "GET", headers={"Authorization": f"Bearer {settings.flutterwave_secret_key}"})
 
     success = handle_response2(ok, status, data)
 
     if not success:
+        # raising lets the task retry, the transaction stays pending until flutterwave answers
+        raise Exception(
+            f"Unable to verify transaction {tx_id} due to {ok} {status} {data}")
 
-        reason = str(data) if type(data) != "str" else data
+    return data["data"]
 
-        try:
-            t = json.loads(reason)
-            reason = t["message"]
 
-        except:
-            pass
+def find_flutterwave_transaction(tx_ref: str):
+    "Look a charge up by our reference, None when flutterwave has no charge for it"
 
-        # Update the user's kyc status
-        db[Collections.users].update_one(
-            {"uid": user_id}, {"$set": {"kyc_status": KYCStatus.REJECTED}})
+    url = make_url(
+        f"{Endpoints.flutterwave_tx_verification.value}/verify_by_reference?tx_ref={tx_ref}")
 
-        # Send an email to the user
-        task_send_mail("kyc_rejected", user["email"], {
-            "first_name": user["first_name"], "reason":  reason})
+    ok, status, data = make_req(
+        url, "GET", headers={"Authorization": f"Bearer {settings.flutterwave_secret_key}"})
 
-        logger.info(
-            f"KYC verification request for user {user_id} failed - {ok} {status} {data}")
+    if status in [400, 404]:
+        return None
 
-        raise CancelExecution(retry=False)
+    success = handle_response2(ok, status, data)
 
-    nin_summary = data["summary"]
-    # nin_status = nin_summary["status"]
+    if not success:
+        raise Exception(
+            f"Unable to look up transaction {tx_ref} due to {ok} {status} {data}")
 
-    field_matches = nin_summary["nin_check"]["fieldMatches"]
+    return data["data"]
 
-    unmatched_fields = []
 
-    if not field_matches.get("firstname", None):
-        unmatched_fields.append("First Name")
+def _fail_transaction(tx_ref: str, reason: str):
 
-    if not field_matches.get("lastname", None):
-        unmatched_fields.append("Last Name")
+    logger.error(f"Payment {tx_ref} failed - {reason}")
 
-    if not field_matches.get("gender", None):
-        unmatched_fields.append("Gender")
+    db[Collections.transactions].update_one({"reference": tx_ref, "status": TransactionStatus.pending}, {
+        "$set": {"status": TransactionStatus.failed, "updated_at": get_utc_timestamp()}})
 
-    if "dob" in field_matches:
-        if not field_matches["dob"]:
-            unmatched_fields.append("Date of Birth")
+    return TransactionStatus.failed
 
-    if len(unmatched_fields) > 0:
 
-        reason = "1. The details you provided do not match the details on your NIN. The following fields do not match: " + \
-            ", ".join(unmatched_fields)
+# payments recorded on each document a payment changes, enough to cover any retry of a payment
+APPLIED_PAYMENTS_KEPT = 50
 
-        if failure_reason:
 
-            reason += f"   2. {failure_reason}"
+def _apply_once(col_name: Collections, query: dict, tx_ref: str, update: dict) -> dict | None:
+    """ Apply a payment's update to the document matching `query` once: the payment is recorded on
+    the document by the same update, and a document that already records it is returned as is.
+    None when no document matches. """
 
-        # Update the user's kyc status
-        db[Collections.users].update_one(
-            {"uid": user_id}, {"$set": {"kyc_status": KYCStatus.REJECTED}})
+    doc = db[col_name].find_one_and_update({**query, "applied_payments": {"$ne": tx_ref}}, {
+        **update, "$push": {"applied_payments": {"$each": [tx_ref], "$slice": -APPLIED_PAYMENTS_KEPT}}}, return_document=ReturnDocument.AFTER)
 
-        # Send an email to the user
-        task_send_mail("kyc_rejected", user["email"], {
-            "first_name": user["first_name"], "reason":  reason})
+    if doc is None:
+        doc = db[col_name].find_one(query)
 
-    else:
+    return doc
 
-        if not approved:
 
-            # Update the user's kyc status
-            db[Collections.users].update_one(
-                {"uid": user_id}, {"$set": {"kyc_status": KYCStatus.REJECTED}})
+def _credit_wallet(wallet_uid: str, tx_ref: str, inc: dict, fields: dict = {}):
 
-            # Send an email to the user
-            task_send_mail("kyc_rejected", user["email"], {
-                "first_name": user["first_name"], "reason":  failure_reason})
+    update = {"$inc": inc, "$set": fields} if fields else {"$inc": inc}
+
+    wallet = _apply_once(Collections.wallets, {
+                         "uid": wallet_uid}, tx_ref, update)
+
+    if not wallet:
+        logger.critical(
+            f"Unable to find wallet with uid {wallet_uid} for a completed payment")
+        return None
+
+    return wallet
+
+
+def _claim_step(tx_ref: str, step: str) -> bool:
+    "Whether this caller is the first to reach `step` of the transaction's completion"
+
+    claimed = db[Collections.transactions].update_one({"reference": tx_ref, "completed_steps": {"$ne": step}}, {
+        "$push": {"completed_steps": step}})
+
+    return claimed.modified_count == 1
+
+
+def _apply_payment(transaction: Transaction):
+    """ The side effects of a successful payment. Every step can run again after a failure: wallet
+    and plan updates are applied once per document, one-off steps are claimed on the tx and
+    notifications are keyed on it, and are stored before this returns. """
+
+    tx_ref = transaction.reference
+    amount = transaction.amount
+    wallet = None
+
+    if transaction.type == TransactionType.topup:
+
+        wallet = _credit_wallet(transaction.wallet, tx_ref, {"balance": amount, "total_amount_deposited": amount}, {
+            "last_transaction_at": get_utc_timestamp()})
 
+        notification_sink.add(
+            transaction.initiator,  NotificationTypes.wallet, "Added funds successfully", f"Your funding of {amount} was successful", dedupe_key=f"{tx_ref}:completed", wait=True)
+
+    elif transaction.type == TransactionType.investment:
+
+        investment = db[Collections.investments].find_one_and_update(
+            {"payment_reference": tx_ref}, {"$set": {"is_active": True}})
+
+        if not investment:
+            logger.critical(
+                f"Unable to find investment with payment reference {tx_ref}")
         else:
+            wallet = _credit_wallet(transaction.wallet, tx_ref, {
+                                    "total_amount_invested": amount})
 
-            # Update the user's kyc status
-            db[Collections.users].update_one(
-                {"uid": user_id}, {"$set": {"kyc_status": KYCStatus.APPROVED}})
+            asset = db[Collections.investible_assets].find_one(
+                {"uid": investment["asset_uid"]}, {"asset_name": 1})
 
-            # Send an email to the user
-            task_send_mail("kyc_approved", user["email"], {
-                "first_name": user["first_name"], })
+            asset_name = asset["asset_name"] if asset else "the asset"
+
+            notification_sink.add(
+                investment["investor_uid"], NotificationTypes.investment, "Investment Successful", f"Your investment in {asset_name} was successful", dedupe_key=f"{tx_ref}:completed", wait=True)
+
+    elif transaction.type == TransactionType.savings_add_funds:
+
+        plan = _apply_once(Collections.goal_savings_plans, {"payment_references": tx_ref}, tx_ref, {
+                           "$inc": {"amount_saved": amount}})
+
+        if not plan:
+            logger.critical(
+                f"Unable to find savings plan with payment reference {tx_ref}")
+        else:
+            if plan["amount_saved"] >= plan["goal_amount"]:
+                db[Collections.goal_savings_plans].update_one(
+                    {"uid": plan["uid"]}, {"$set": {"completed": True}})
+
+            notification_sink.add(
+                transaction.initiator, NotificationTypes.savings, "Add Fund to Savings Plan Successful", f"You added funds to savings plan {plan['goal_name']} ", dedupe_key=f"{tx_ref}:completed", wait=True)
+
+    elif transaction.type == TransactionType.locked_savings_add_funds:
+
+        plan = _apply_once(Collections.locked_savings_plans, {"payment_references": tx_ref}, tx_ref, {
+                           "$inc": {"amount_saved": amount}})
+
+        if not plan:
+            logger.critical(
+                f"Unable to find locked savings plan with payment reference {tx_ref}")
+        else:
+            asset = db[Collections.investible_assets].find_one(
+                {"uid": plan["asset_uid"]}, {"price": 1, "units": 1})
+
+            if asset and plan["amount_saved"] >= (asset["price"] / asset["units"]):
+                db[Collections.locked_savings_plans].update_one(
+                    {"uid": plan["uid"]}, {"$set": {"ready_for_investment": True}})
+
+            notification_sink.add(
+                transaction.initiator, NotificationTypes.savings, "Add Fund to Locked Savings Plan Successful", f"You added funds to locked savings plan {plan['lock_name']} ", dedupe_key=f"{tx_ref}:completed", wait=True)
+
+    elif transaction.type == TransactionType.membership_fee:
+
+        wallet = _credit_wallet(
+            transaction.wallet, tx_ref, {}, {"is_active": True})
+
+        user = db[Collections.users].find_one_and_update(
+            {"uid": transaction.initiator}, {"$set": {"has_paid_membership_fee": True}})
+
+        if not user:
+            logger.critical(
+                f"Unable to find user with uid {transaction.initiator}")
+        else:
+            # process referral/affiliate code if present
+
+            if _claim_step(tx_ref, "referral"):
+                if user.get("referral_code", None):
+                    task_process_referral_code(
+                        user["uid"], user["referral_code"])
+                elif user.get("affiliate_code", None):
+                    task_process_affiliate_code(
+                        user["uid"], user["affiliate_code"])
+
+            notification_sink.add(
+                transaction.initiator, NotificationTypes.account, "Membership Fee Paid", "Your membership fee payment was successful", dedupe_key=f"{tx_ref}:completed", wait=True)
+
+    if wallet is None:
+        wallet = db[Collections.wallets].find_one(
+            {"uid": transaction.wallet}, {"balance": 1})
+
+    return wallet
+
+
+def complete_transaction(tx_ref: str, tx_id: str | None, reported_status: str, verified: dict | None = None) -> TransactionStatus | None:
+    """ Apply the outcome of a flutterwave charge to a pending transaction.
+
+    A verified charge moves the transaction from pending to processing with a conditional update,
+    then its side effects run and it becomes successful. If a side effect fails the transaction
+    stays processing, and the next call (a task retry, the redirect, the webhook or the sweeper)
+    resumes the side effects, each of which applies only once. Callers that already hold the
+    flutterwave verification result pass it as `verified` to skip the lookup.
+    """
+
+    transaction = db[Collections.transactions].find_one({"reference": tx_ref})
+
+    if not transaction:
+        logger.error(f"Transaction with reference {tx_ref} not found")
+        return None
+
+    transaction = Transaction(**transaction)
+
+    if transaction.status not in [TransactionStatus.pending, TransactionStatus.processing]:
+        return transaction.status
+
+    if transaction.type not in COMPLETABLE_TX_TYPES:
+        logger.error(
+            f"Transaction type not allowed - {transaction.type}")
+        return transaction.status
+
+    if transaction.status == TransactionStatus.pending:
+
+        if transaction.type == TransactionType.topup and transaction.direction != TransactionDirection.incoming:
+            return _fail_transaction(tx_ref, "not an incoming transaction")
+
+        if reported_status not in ["successful", "completed"]:
+            return _fail_transaction(tx_ref, f"reported status {reported_status}")
+
+        if not tx_id:
+            return _fail_transaction(tx_ref, "missing transaction id")
+
+        result = verified or verify_flutterwave_transaction(tx_id)
+
+        if result["tx_ref"] != transaction.reference:
+            return _fail_transaction(tx_ref, f"reference mismatch {result['tx_ref']}")
+
+        if result["status"] != "successful":
+            return _fail_transaction(tx_ref, f"status mismatch {result['status']}")
+
+        if transaction.amount > result["amount"]:
+            return _fail_transaction(tx_ref, f"amount mismatch {result['amount']}")
+
+        claimed = db[Collections.transactions].find_one_and_update({"reference": tx_ref, "status": TransactionStatus.pending}, {
+            "$set": {"status": TransactionStatus.processing, "tx_id": str(tx_id), "updated_at": get_utc_timestamp()}}, {"status": 1})
+
+        if claimed is None:
+            # completed or failed by another worker in the meantime, or already processing
+            current = db[Collections.transactions].find_one(
+                {"reference": tx_ref}, {"status": 1})
+
+            if current["status"] != TransactionStatus.processing:
+                return TransactionStatus(current["status"])
+
+    wallet = _apply_payment(transaction)
+
+    db[Collections.transactions].update_one({"reference": tx_ref, "status": TransactionStatus.processing}, {"$set": {
+        "status": TransactionStatus.successful, "balance_after": wallet["balance"] if wallet is not None else transaction.balance_after, "updated_at": get_utc_timestamp()}})
+
+    return TransactionStatus.successful
+
+
+@exp_backoff_task(retries=5, retry_backoff=1.5, retry_delay=10, priority=PRIORITY_HIGH)
+def task_complete_payment(tx_ref: str, tx_id: str | None, reported_status: str):
+
+    logger.info(f"Completing payment {tx_ref} reported as {reported_status}")
+
+    complete_transaction(tx_ref, tx_id, reported_status)
+
+
+@exp_backoff_task(retries=5, retry_backoff=1.5, retry_delay=10, priority=PRIORITY_HIGH)
+def task_process_payment_event(event_uid: str):
+
+    event = db[Collections.payment_events].find_one({"uid": event_uid})
+
+    if not event:
+        logger.error(f"Payment event {event_uid} does not exist")
+        raise CancelExecution(retry=False)
+
+    event = PaymentEvent(**event)
+
+    if event.status != PaymentEventStatus.queued:
+        raise CancelExecution(retry=False)
+
+    if not event.tx_ref or not event.event_type.startswith("charge."):
+        status, result = PaymentEventStatus.ignored, None
+
+    else:
+        result = complete_transaction(
+            event.tx_ref, event.tx_id, event.reported_status)
+
+        status = PaymentEventStatus.failed if result is None else PaymentEventStatus.processed
+
+    db[Collections.payment_events].update_one({"uid": event_uid}, {"$set": {
+        "status": status, "result": result, "processed_at": get_utc_timestamp()}})
+
+
+def _reconcile_transaction(transaction: dict, expire_before: float) -> str:
+
+    tx_ref = transaction["reference"]
+
+    if transaction["status"] == TransactionStatus.processing:
+        # verified already, resume the side effects that did not get applied
+        status = complete_transaction(tx_ref, None, "successful")
+        return "settled" if status == TransactionStatus.successful else "failed"
+
+    result = find_flutterwave_transaction(tx_ref)
+
+    if result is None:
+        # nothing charged yet; the user may still be on the checkout page, so only give up on it
+        # once it has expired
+        if transaction["created_at"] < expire_before:
+            _fail_transaction(
+                tx_ref, f"no charge found on flutterwave after {settings.tx_pending_expiry_mins} minutes")
+            return "expired"
+
+        return "pending"
+
+    if result["status"] == "successful":
+        status = complete_transaction(
+            tx_ref, str(result["id"]), result["status"], verified=result)
+        return "settled" if status == TransactionStatus.successful else "failed"
+
+    if result["status"] == "failed":
+        _fail_transaction(tx_ref, "charge failed on flutterwave")
+        return "failed"
+
+    if transaction["created_at"] < expire_before:
+        _fail_transaction(
+            tx_ref, f"charge still {result['status']} after {settings.tx_pending_expiry_mins} minutes")
+        return "expired"
+
+    return "pending"
+
+
+def reconcile_pending_transactions() -> dict:
+    """ Settle or expire pending charges that are older than tx_validity_lax_mins, and finish
+    processing ones whose side effects failed.
+
+    Pending transactions are read in batches along the (status, created_at) index, paged on
+    (created_at, _id) so that transactions sharing a created_at are not skipped, and looked up on
+    flutterwave by reference, tx_sweep_concurrency at a time.
+    """
+
+    started = time.monotonic()
+    now = get_utc_timestamp()
+
+    cutoff = now - (settings.tx_validity_lax_mins * 60)
+    expire_before = now - (settings.tx_pending_expiry_mins * 60)
+
+    query = {
+        "status": {"$in": [TransactionStatus.pending, TransactionStatus.processing]},
+        "type": {"$in": COMPLETABLE_TX_TYPES},
+        "created_at": {"$lt": cutoff},
+    }
+
+    outcomes = Counter()
+    after = None
+
+    with ThreadPoolExecutor(max_workers=settings.tx_sweep_concurrency) as executor:
+
+        while outcomes.total() < settings.tx_sweep_max_per_run:
+
+            batch_query = query if after is None else {**query, "$or": [
+                {"created_at": {"$gt": after[0]}},
+                {"created_at": after[0], "_id": {"$gt": after[1]}},
+            ]}
+
+            batch = list(db[Collections.transactions].find(batch_query, {"reference": 1, "status": 1, "created_at": 1}).sort(
+                [("created_at", 1), ("_id", 1)]).limit(settings.tx_sweep_batch_size))
+
+            if not batch:
+                break
+
+            after = (batch[-1]["created_at"], batch[-1]["_id"])
+
+            futures = [executor.submit(
+                _reconcile_transaction, transaction, expire_before) for transaction in batch]
+
+            for transaction, future in zip(batch, futures):
+                try:
+                    outcomes[future.result()] += 1
+
+                except Exception as e:
+                    outcomes["errors"] += 1
+                    logger.error(
+                        f"Unable to reconcile transaction {transaction['reference']} - {e}")
+
+    elapsed = time.monotonic() - started
+    processed = outcomes.total()
+
+    report = {
+        **outcomes,
+        "processed": processed,
+        "elapsed_secs": round(elapsed, 2),
+        "throughput_per_sec": round(processed / elapsed, 2) if elapsed else 0,
+        "backlog": db[Collections.transactions].count_documents(query),
+    }
+
+    logger.info(f"Pending transaction sweep - {report}")
+
+    return report
+
+
+@huey.periodic_task(crontab(minute=f"*/{settings.tx_sweep_interval_mins}"), name="task_reconcile_pending_transactions")
+@huey.lock_task("reconcile-pending-transactions")
+def task_reconcile_pending_transactions():
+    return reconcile_pending_transactions()
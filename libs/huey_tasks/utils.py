@@ -1,18 +1,24 @@
+import random
 import functools
+from huey import Huey
 from .config import huey
 
 
-def exp_backoff_task(retries=10, retry_backoff=1.15, retry_delay=1):
+def exp_backoff_task(retries=10, retry_backoff=1.15, retry_delay=1, queue: Huey = huey, priority=None, context=False):
     def deco(fn):
         @functools.wraps(fn)
         def inner(*args, **kwargs):
 
-            task = kwargs.pop('task')
+            # with context the task is passed on to fn as well, e.g. for its id
+            task = kwargs['task'] if context else kwargs.pop('task')
             try:
                 return fn(*args, **kwargs)
             except Exception as exc:
-                task.retry_delay *= retry_backoff
+                # half of the delay is fixed and half random, so that tasks failing together (an
+                # outage of a dependency) do not all retry at the same moment
+                delay = retry_delay * retry_backoff ** max(0, retries - task.retries)
+                task.retry_delay = delay / 2 + random.uniform(0, delay / 2)
                 raise exc
 
-        return huey.task(retries=retries, retry_delay=retry_delay, context=True)(inner)
+        return queue.task(retries=retries, retry_delay=retry_delay, priority=priority, context=True)(inner)
     return deco
@@ -0,0 +1,68 @@
+""" Enqueue/dequeue throughput of the SQLite and MongoDB huey storage backends.
+
+Several threads enqueue at once, as the web and consumer workers do, then drain the queue
+concurrently. The MongoDB run uses the configured database (settings.db_url) under a throwaway
+queue name and removes its data afterwards.
+
+    python -m libs.load_test_db.huey_storage_throughput [tasks] [threads]
+"""
+
+import os
+import sys
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from huey.storage import SqliteStorage
+from libs.config.settings import get_settings
+from libs.huey_tasks.storage import MongoStorage
+from libs.utils.pure_functions import get_uuid4
+
+
+settings = get_settings()
+
+PAYLOAD = os.urandom(512)
+
+
+def measure(label, storage, tasks: int, threads: int):
+    storage.flush_all()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        started = time.monotonic()
+        list(executor.map(lambda _: storage.enqueue(PAYLOAD), range(tasks)))
+        enqueue_secs = time.monotonic() - started
+
+        def drain(_):
+            n = 0
+
+            while storage.dequeue() is not None:
+                n += 1
+
+            return n
+
+        started = time.monotonic()
+        dequeued = sum(executor.map(drain, range(threads)))
+        dequeue_secs = time.monotonic() - started
+
+    storage.flush_all()
+
+    print(f"{label}: enqueue {tasks / enqueue_secs:.0f} tasks/s, dequeue {dequeued / dequeue_secs:.0f} tasks/s ({dequeued}/{tasks} dequeued)")
+
+
+def main(tasks: int = 5000, threads: int = 10):
+    with tempfile.TemporaryDirectory() as tmp:
+        measure("sqlite", SqliteStorage(name="bench", filename=os.path.join(
+            tmp, "huey.db")), tasks, threads)
+
+    storage = MongoStorage(name=f"bench-{get_uuid4()}",
+                           url=settings.db_url, db_name=settings.db_name)
+
+    measure("mongo", storage, tasks, threads)
+
+    storage.close()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+
+    main(int(args[0]) if len(args) > 0 else 5000,
+         int(args[1]) if len(args) > 1 else 10)
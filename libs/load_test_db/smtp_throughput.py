@@ -0,0 +1,114 @@
+""" Compare per-message SMTP connections against the pooled connections used by dispatch_email.
+
+Starts a local SMTP stand-in that accepts everything and sleeps `handshake_ms` when a client
+connects, standing in for the TCP + TLS setup and login of the real mail server.
+
+    python -m libs.load_test_db.smtp_throughput [messages] [threads] [handshake_ms]
+"""
+
+import sys
+import time
+import smtplib
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+from libs.emails.smtp_pool import SMTPPool
+
+
+class StandInHandler(socketserver.StreamRequestHandler):
+
+    handshake = 0.0
+
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        time.sleep(self.handshake)
+        self.reply("220 stand-in ready")
+
+        while True:
+            line = self.rfile.readline()
+
+            if not line:
+                return
+
+            command = line.decode().strip().upper()
+
+            if command.startswith("EHLO"):
+                self.reply("250-stand-in")
+                self.reply("250 AUTH PLAIN LOGIN")
+
+            elif command.startswith("AUTH"):
+                self.reply("235 authenticated")
+
+            elif command.startswith("DATA"):
+                self.reply("354 end with .")
+
+                while self.rfile.readline() not in [b".\r\n", b""]:
+                    pass
+
+                self.reply("250 queued")
+
+            elif command.startswith("QUIT"):
+                self.reply("221 bye")
+                return
+
+            else:
+                self.reply("250 ok")
+
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+MESSAGE = "Subject: benchmark\r\n\r\n" + "x" * 2048
+
+
+def send_unpooled(host, port):
+    with smtplib.SMTP(host, port) as smtp:
+        smtp.login("user", "pass")
+        smtp.sendmail("from@example.com", "to@example.com", MESSAGE)
+
+
+def run(label, send, messages, threads):
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda _: send(), range(messages)))
+
+    elapsed = time.monotonic() - started
+
+    print(f"{label}: {messages} messages in {elapsed:.2f}s - {messages / elapsed:.1f} messages/s")
+
+
+def main(messages: int = 500, threads: int = 6, handshake_ms: float = 20):
+    StandInHandler.handshake = handshake_ms / 1000
+
+    server = StandInServer(("127.0.0.1", 0), StandInHandler)
+    host, port = server.server_address
+
+    ThreadPoolExecutor(max_workers=1).submit(server.serve_forever)
+
+    def connect():
+        smtp = smtplib.SMTP(host, port)
+        smtp.login("user", "pass")
+        return smtp
+
+    pool = SMTPPool(connect=connect, size=threads)
+
+    run("new connection per message", lambda: send_unpooled(
+        host, port), messages, threads)
+    run("pooled connections", lambda: pool.sendmail(
+        "from@example.com", "to@example.com", MESSAGE), messages, threads)
+
+    print(f"pool: {pool.stats()}")
+
+    pool.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+
+    main(int(args[0]) if len(args) > 0 else 500, int(args[1]) if len(args) > 1 else 6,
+         float(args[2]) if len(args) > 2 else 20)
@@ -1,13 +1,36 @@
 import math
+import asyncio
+from typing import Callable
 from fastapi import HTTPException
 from pydantic import BaseModel, EmailStr
 from libs.config.settings import get_settings
 from ..db import _db, Collections
 from .pure_functions import get_utc_timestamp
+from .cache import TTLCache
+from ..logging import Logger
 
 
 settings = get_settings()
 
+logger = Logger(f"{__package__}.{__name__}")
+
+
+# read-mostly collections whose records are cached by uid in find_record
+RECORD_CACHES: dict[Collections, TTLCache] = {
+    Collections.investible_assets: TTLCache(Collections.investible_assets.value, ttl=settings.asset_cache_ttl_secs, max_size=settings.asset_cache_max_size),
+}
+
+# callbacks run with (pk_name, pk) whenever update_record writes to the collection
+WRITE_HOOKS: dict[Collections, list[Callable[[str, str], None]]] = {}
+
+# updated fields that do not trigger the write hooks when seen on a change stream
+WATCH_IGNORED_FIELDS: dict[Collections, set[str]] = {}
+
+
+def register_write_hook(col_name: Collections, hook: Callable[[str, str], None], ignore_fields: set[str] = set()):
+    WRITE_HOOKS.setdefault(col_name, []).append(hook)
+    WATCH_IGNORED_FIELDS.setdefault(col_name, set()).update(ignore_fields)
+
 
 class Paginator:
 
@@ -118,6 +141,8 @@ async def update_record(cls: BaseModel, data: dict,  col_name: Collections,  pk_
 
     await _db[col_name].update_one({pk_name: data[pk_name]}, {"$set": data})
 
+    invalidate_cached_record(col_name, pk_name, data[pk_name])
+
     if not refresh_from_db:
         return cls(**data)
 
@@ -128,9 +153,19 @@ async def update_record(cls: BaseModel, data: dict,  col_name: Collections,  pk_
         return cls(**updated_data)
 
 
-async def find_record(cls: BaseModel, col_name: Collections, pk_name: str,  pk: str, raise_404=True):
+async def find_record(cls: BaseModel, col_name: Collections, pk_name: str,  pk: str, raise_404=True, use_cache=True):
+
+    cache = RECORD_CACHES.get(col_name, None)
+
+    if cache is not None and use_cache and pk_name == "uid":
+
+        async def load():
+            return await _db[col_name].find_one({pk_name: pk})
 
-    record = await _db[col_name].find_one({pk_name: pk})
+        record = await cache.get_or_load(pk, load)
+
+    else:
+        record = await _db[col_name].find_one({pk_name: pk})
 
     if not record:
         if raise_404:
@@ -142,3 +177,90 @@ async def find_record(cls: BaseModel, col_name: Collections, pk_name: str,  pk:
     else:
 
         return cls(**record)
+
+
+async def hydrate_records(items: list[dict], cls: BaseModel, col_name: Collections, local_key: str, target_key: str, pk_name: str = "uid"):
+    """ Attach the related `col_name` record of every item under `target_key` using a single $in query. """
+
+    keys = list({item[local_key] for item in items if item.get(local_key)})
+
+    if not keys:
+        return items
+
+    cache = RECORD_CACHES.get(col_name, None) if pk_name == "uid" else None
+
+    records = []
+
+    if cache is not None:
+        for key in keys:
+            record = cache.get(key)
+
+            if record is not None:
+                records.append(record)
+
+        keys = [key for key in keys if cache.get(key, count=False) is None]
+
+    if keys:
+        fetched = await _db[col_name].find({pk_name: {"$in": keys}}).to_list(length=len(keys))
+
+        for record in fetched:
+            if cache is not None:
+                cache.set(record[pk_name], record)
+
+            records.append(record)
+
+    by_pk = {record[pk_name]: cls(**record).model_dump(by_alias=True)
+             for record in records}
+
+    for item in items:
+        item[target_key] = by_pk.get(item.get(local_key))
+
+    return items
+
+
+def invalidate_cached_record(col_name: Collections, pk_name: str, pk: str):
+    for hook in WRITE_HOOKS.get(col_name, []):
+        hook(pk_name, pk)
+
+    cache = RECORD_CACHES.get(col_name, None)
+
+    if cache is None:
+        return
+
+    if pk_name == "uid":
+        cache.invalidate(pk)
+    else:
+        cache.clear()
+
+
+async def watch_record_caches():
+    """ Invalidate cached records, and run the write hooks, on writes made by other workers and
+    by the huey consumers, using change streams.
+
+    Change streams need a replica set; on a standalone server this logs once and returns,
+    leaving the cache TTL as the staleness bound.
+    """
+
+    async def watch(col_name: Collections):
+        ignored = WATCH_IGNORED_FIELDS.get(col_name, set())
+
+        try:
+            async with _db[col_name].watch(full_document="updateLookup") as stream:
+                async for change in stream:
+                    updated = change.get("updateDescription", {}).get("updatedFields", {})
+
+                    if updated and set(updated) <= ignored:
+                        continue
+
+                    doc = change.get("fullDocument", None)
+
+                    if doc and doc.get("uid"):
+                        invalidate_cached_record(col_name, "uid", doc["uid"])
+                    else:
+                        invalidate_cached_record(col_name, "_id", None)
+
+        except Exception as e:
+            logger.warn(
+                f"Change stream for {col_name.value} unavailable, relying on cache ttl - {e}")
+
+    await asyncio.gather(*[watch(col_name) for col_name in set(RECORD_CACHES) | set(WRITE_HOOKS)])
@@ -0,0 +1,128 @@
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    "In-process cache with per-entry expiry, a bounded size and hit/miss counters"
+
+    def __init__(self, name: str, ttl: float, max_size: int = 1024) -> None:
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[Any, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None, count=True):
+        entry = self._entries.get(key, None)
+
+        if entry is not None:
+            expires_at, value = entry
+
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+
+                if count:
+                    self.hits += 1
+
+                return value
+
+            del self._entries[key]
+
+        if count:
+            self.misses += 1
+
+        return default
+
+    def set(self, key, value, ttl: float | None = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Any, Any], bool]):
+        stale = [key for key, (_, value) in self._entries.items()
+                 if predicate(key, value)]
+
+        for key in stale:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def is_loading(self, key) -> bool:
+        "Whether a get_or_load call for `key` is waiting on its loader"
+
+        return key in self._inflight
+
+    async def get_or_load(self, key, loader: Callable[[], Awaitable[Any]], ttl: float | Callable[[Any], float] | None = None):
+        """ Return the cached value for `key`, calling `loader` on a miss.
+
+        Concurrent misses for the same key share one call to `loader`. `None` results are not cached.
+        `ttl` may be a callable that picks the lifetime from the loaded value.
+        """
+
+        value = self.get(key, _MISSING, count=False)
+
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        if key in self._inflight:
+            self.coalesced += 1
+            return await asyncio.shield(self._inflight[key])
+
+        self.misses += 1
+
+        async def load():
+            try:
+                value = await loader()
+
+                if value is not None:
+                    self.set(key, value, ttl(value) if callable(ttl) else ttl)
+
+                return value
+
+            finally:
+                self._inflight.pop(key, None)
+
+        # a task of its own, so that cancelling the caller that started it does not cancel or
+        # strand the callers waiting on it
+        task = asyncio.ensure_future(load())
+        self._inflight[key] = task
+
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+
+        return {
+            "name": self.name,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            # coalesced lookups did not reach the loader either, so they count towards the ratio
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
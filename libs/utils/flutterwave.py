@@ -1,18 +1,25 @@
-from models.payments import Transaction
-from fastapi import HTTPException
+import time
+import asyncio
+from models.payments import Transaction, TransactionStatus, TransactionType
+from fastapi import HTTPException, Request
+from fastapi.responses import RedirectResponse
+from libs.db import _db, Collections
+from libs.huey_tasks.tasks import task_complete_payment
+from libs.huey_tasks.task_buffer import task_buffer
 from models.users import AuthenticationContext
 from libs.config.settings import get_settings
-from libs.utils.req_helpers import make_req, make_url, Endpoints, handle_response
+from libs.utils.req_helpers import async_make_req, make_url, Endpoints, handle_response
 from models.wallets import BankAccount
+from libs.utils.cache import TTLCache
 from libs.logging import Logger
-from fastapi import HTTPException
 
 logger = Logger(f"{__package__}.{__name__}")
 
 settings = get_settings()
 
 
-def _resolve_bank_account(bank_code: str, account_number: str):
+async def _fetch_bank_account(bank_code: str, account_number: str):
+    """ Resolve an account upstream, returning None when Flutterwave reports it as invalid. """
 
     try:
 
@@ -30,12 +37,11 @@ def _resolve_bank_account(bank_code: str, account_number: str):
             "account_name": "Pastor Bright"
         }
 
-        ok, status, data = make_req(
+        ok, status, data = await async_make_req(
             url, "POST", headers={"Authorization": f"Bearer {settings.flutterwave_secret_key}"}, body=body)
 
         if str(status) == "400":
-            raise HTTPException(
-                status_code=400, detail="Invalid bank account")
+            return None
 
         success = handle_response(ok, status, data)
 
@@ -56,14 +62,41 @@ def _resolve_bank_account(bank_code: str, account_number: str):
             status_code=500, detail="Unable to resolve bank account")
 
 
-def _get_supported_banks(country: str = "NG"):
+_INVALID_ACCOUNT = {}
+
+bank_account_cache = TTLCache("bank_account_resolution", ttl=settings.bank_account_cache_ttl_secs,
+                              max_size=settings.bank_account_cache_max_size)
+
+
+async def _resolve_bank_account(bank_code: str, account_number: str):
+
+    async def load():
+        result = await _fetch_bank_account(bank_code, account_number)
+        return _INVALID_ACCOUNT if result is None else result
+
+    def ttl_for(result):
+        if result is _INVALID_ACCOUNT:
+            return settings.bank_account_negative_cache_ttl_secs
+
+        return settings.bank_account_cache_ttl_secs
+
+    result = await bank_account_cache.get_or_load((bank_code, account_number), load, ttl=ttl_for)
+
+    if result is _INVALID_ACCOUNT:
+        raise HTTPException(
+            status_code=400, detail="Invalid bank account")
+
+    return result
+
+
+async def _fetch_supported_banks(country: str = "NG"):
 
     try:
 
         url = make_url(
             f"{Endpoints.flutterwave_get_banks.value}/{country}")
 
-        ok, status, data = make_req(
+        ok, status, data = await async_make_req(
             url, "GET", headers={"Authorization": f"Bearer {settings.flutterwave_secret_key}"})
 
         success = handle_response(ok, status, data)
@@ -85,14 +118,105 @@ def _get_supported_banks(country: str = "NG"):
             status_code=500, detail="Unable to get supported banks")
 
 
-def _verify_transaction(tx_id: str, user_id: str):
+class BankCatalog:
+    """ Supported banks per country, served from memory.
+
+    Fresh for `ttl` seconds; for a further `stale_ttl` seconds the stale list is served while one
+    background refresh runs. Concurrent refreshes for a country share a single upstream call.
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float) -> None:
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        # fresh entries, and the single flight of their loads
+        self._fresh = TTLCache("supported_banks", ttl=ttl)
+        # the last list loaded per country, served while stale
+        self._entries: dict[str, tuple[float, list, dict]] = {}
+        # the loop only holds weak references to tasks, keep the background refreshes alive
+        self._refreshes: set[asyncio.Task] = set()
+
+    async def _load(self, country: str):
+        banks = await _fetch_supported_banks(country)
+        index = {bank["code"]: bank["name"] for bank in banks}
+
+        self._entries[country] = (time.monotonic(), banks, index)
+
+        return self._entries[country]
+
+    def _refresh_done(self, country: str, task: asyncio.Task):
+        self._refreshes.discard(task)
+
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(
+                f"Unable to refresh supported banks for country {country}, serving the stale list - {task.exception()}")
+
+    async def _get_entry(self, country: str):
+        entry = self._fresh.get(country, count=False)
+
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        entry = self._entries.get(country, None)
+
+        if entry is not None and time.monotonic() - entry[0] < self.ttl + self.stale_ttl:
+            self.stale_hits += 1
+
+            if not self._fresh.is_loading(country):
+                task = asyncio.get_running_loop().create_task(
+                    self._fresh.get_or_load(country, lambda: self._load(country)))
+                self._refreshes.add(task)
+                task.add_done_callback(
+                    lambda t: self._refresh_done(country, t))
+
+            return entry
+
+        self.misses += 1
+
+        return await self._fresh.get_or_load(country, lambda: self._load(country))
+
+    async def get_banks(self, country: str = "NG") -> list:
+        _, banks, _ = await self._get_entry(country)
+        return banks
+
+    async def get_bank_name(self, bank_code: str, country: str = "NG") -> str | None:
+        _, _, index = await self._get_entry(country)
+        return index.get(bank_code, None)
+
+    def stats(self) -> dict:
+        return {
+            "name": "supported_banks",
+            "countries": list(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self._fresh.coalesced,
+        }
+
+
+bank_catalog = BankCatalog(settings.banks_catalog_ttl_secs,
+                           settings.banks_catalog_stale_secs)
+
+
+async def _get_supported_banks(country: str = "NG"):
+    return await bank_catalog.get_banks(country)
+
+
+async def _get_bank_name(bank_code: str, country: str = "NG"):
+    return await bank_catalog.get_bank_name(bank_code, country)
+
+
+async def _verify_transaction(tx_id: str, user_id: str):
 
     try:
 
         url = make_url(
             f"{Endpoints.flutterwave_tx_verification.value}/{tx_id}/verify")
 
-        ok, status, data = make_req(
+        ok, status, data = await async_make_req(
             url, "GET", headers={"Authorization": f"Bearer {settings.flutterwave_secret_key}"})
 
         success = handle_response(ok, status, data)
@@ -114,7 +238,7 @@ def _verify_transaction(tx_id: str, user_id: str):
             status_code=500, detail="Unable to verify transaction")
 
 
-def _initiate_payment(transaction: Transaction, auth_context: AuthenticationContext, customizations: dict = {}):
+async def _initiate_payment(transaction: Transaction, auth_context: AuthenticationContext, customizations: dict = {}):
 
     try:
 
@@ -140,7 +264,7 @@ def _initiate_payment(transaction: Transaction, auth_context: AuthenticationCont
             "Authorization": f"Bearer {settings.flutterwave_secret_key}",
         }
 
-        ok, status, data = make_req(
+        ok, status, data = await async_make_req(
             url, "POST", headers=headers, body=payment_payload)
 
         success = handle_response(ok, status, data)
@@ -162,7 +286,7 @@ def _initiate_payment(transaction: Transaction, auth_context: AuthenticationCont
             status_code=500, detail="Unable to initiate payment")
 
 
-def _initiate_topup_payment(transaction: Transaction, auth_context: AuthenticationContext):
+async def _initiate_topup_payment(transaction: Transaction, auth_context: AuthenticationContext):
 
     try:
 
@@ -191,7 +315,7 @@ def _initiate_topup_payment(transaction: Transaction, auth_context: Authenticati
             "Authorization": f"Bearer {settings.flutterwave_secret_key}",
         }
 
-        ok, status, data = make_req(
+        ok, status, data = await async_make_req(
             url, "POST", headers=headers, body=payment_payload)
 
         success = handle_response(ok, status, data)
@@ -213,7 +337,7 @@ def _initiate_topup_payment(transaction: Transaction, auth_context: Authenticati
             status_code=500, detail="Unable to initiate payment")
 
 
-def _initiate_withdrawal(transaction: Transaction, auth_context: AuthenticationContext, bank_account: BankAccount):
+async def _initiate_withdrawal(transaction: Transaction, auth_context: AuthenticationContext, bank_account: BankAccount):
 
     try:
 
@@ -245,7 +369,7 @@ def _initiate_withdrawal(transaction: Transaction, auth_context: AuthenticationC
             "Authorization": f"Bearer {settings.flutterwave_secret_key}",
         }
 
-        ok, status, data = make_req(
+        ok, status, data = await async_make_req(
             url, "POST", headers=headers, body=payment_payload)
 
         success = handle_response(ok, status, data)
@@ -265,3 +389,47 @@ def _initiate_withdrawal(transaction: Transaction, auth_context: AuthenticationC
             f"Unable to initiate withdrawal payment for user {auth_context.user.uid} due to {e} ")
         raise HTTPException(
             status_code=500, detail="Unable to initiate payment")
+
+
+async def _get_payment_redirect(req:  Request, allowed_tx_types: list[TransactionType]):
+    """ Redirect the user back to the app with the current status of the transaction.
+
+    Completion itself happens in the payment workers; a pending transaction is handed to them
+    in case the webhook has not arrived yet, and the app is told the payment is still pending.
+    """
+
+    query = req.query_params
+
+    tx_status = query.get("status", None)
+    tx_ref = query.get("tx_ref", None)
+    tx_id = query.get("transaction_id", None)
+
+    if not tx_status or not tx_ref:
+        logger.error(
+            f"Invalid payment request parameters - {tx_status} {tx_ref} {tx_id}")
+        raise HTTPException(
+            status_code=400, detail="Invalid payment request parameters")
+
+    transaction = await _db[Collections.transactions].find_one({"reference": tx_ref}, {"status": 1, "type": 1})
+
+    if not transaction:
+        logger.error(
+            f"Transaction with reference {tx_ref} not found")
+        status = TransactionStatus.failed
+
+    elif transaction["type"] not in allowed_tx_types:
+        logger.error(
+            f"Transaction type not allowed - {transaction['type']}")
+        status = TransactionStatus.failed
+
+    else:
+        status = TransactionStatus(transaction["status"])
+
+    if status == TransactionStatus.processing:
+        # verified, its side effects are still being applied
+        status = TransactionStatus.pending
+
+    if status == TransactionStatus.pending:
+        task_buffer.submit(task_complete_payment, tx_ref, tx_id, tx_status)
+
+    return RedirectResponse(f"{settings.app_url}?showTx=true&txStatus={status.value}&txRef={tx_ref}")
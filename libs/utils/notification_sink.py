@@ -0,0 +1,252 @@
+import time
+import queue
+import threading
+from collections import OrderedDict
+from typing import Callable
+from concurrent.futures import Future
+from pymongo import MongoClient
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError
+from libs.config.settings import get_settings
+from models.notifications import Notification, NotificationTypes
+from ..db import Collections
+from ..logging import Logger
+
+
+settings = get_settings()
+
+logger = Logger(f"{__package__}.{__name__}")
+
+DUPLICATE_KEY = 11000
+
+
+class NotificationSink:
+    """ Accepts notifications from routes and tasks and writes them to the notifications collection
+    with insert_many, from a background thread, once batch_size are pending or every flush_interval.
+
+    A batch that fails is retried until it is stored. Every notification carries a dedupe key (its
+    uid unless the caller gives one) under a unique index, so a retried batch, or a caller that
+    runs again, never stores the same notification twice.
+
+    Pending notifications are only held in memory: those added by routes are lost if the process
+    dies before the next flush (a graceful shutdown writes them). Once max_pending are waiting,
+    routes hand theirs to `overflow` (the task queue, see tasks.py) instead, keeping the dedupe key.
+    Huey tasks add theirs with wait=True, which returns once the batch holding it is stored, so a
+    task is never acknowledged before its notifications are written.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_pending: int, retry_interval: float, user_cache_size: int, db: Database | None = None) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retry_interval = retry_interval
+        self.user_cache_size = user_cache_size
+        self.written = 0
+        self.batches = 0
+        self.duplicates = 0
+        self.unknown_users = 0
+        self.failures = 0
+        self.overflowed = 0
+        self.overflow: Callable[[Notification], None] | None = None
+        self._db = db
+        self._known_users: OrderedDict[str, None] = OrderedDict()
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def get_db(self) -> Database:
+        if self._db is None:
+            self._db = MongoClient(settings.db_url)[settings.db_name]
+
+        return self._db
+
+    def add(self, user_id: str, notification_type: NotificationTypes, title: str, body: str, dedupe_key: str | None = None, wait: bool = False) -> Notification:
+        """ Queue a notification for the user, written within flush_interval.
+
+        With wait, block until it is stored, raising if that takes longer than
+        notification_wait_secs or it is given up on shutdown. Only for threads that may block.
+        """
+
+        notification = Notification(
+            user_id=user_id, notification_type=notification_type, title=title, body=body)
+        notification.dedupe_key = dedupe_key or notification.uid
+
+        if not wait:
+            if len(self) >= self.max_pending and self.overflow is not None:
+                # the writer has fallen behind, never block the event loop on the database
+                self.overflowed += 1
+                logger.warn(
+                    f"{len(self)} notifications pending, queueing {notification.title} for {user_id} as a task")
+                self.overflow(notification)
+                return notification
+
+            self._queue.put((notification, None))
+            self.start()
+
+            return notification
+
+        stored = Future()
+
+        self._queue.put((notification, stored))
+        self.start()
+
+        stored.result(timeout=settings.notification_wait_secs)
+
+        return notification
+
+    def _take_batch(self, timeout: float) -> list[tuple[Notification, Future | None]]:
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _known(self, user_ids: set[str]) -> set[str]:
+        "The given user ids that exist, looking up only the ones not seen before"
+
+        unseen = {user_id for user_id in user_ids if user_id not in self._known_users}
+
+        for user_id in user_ids - unseen:
+            self._known_users.move_to_end(user_id)
+
+        if unseen:
+            found = {user["uid"] for user in self.get_db()[Collections.users].find(
+                {"uid": {"$in": list(unseen)}}, {"uid": 1})}
+
+            for user_id in found:
+                self._known_users[user_id] = None
+
+            # evict the users least recently notified
+            while len(self._known_users) > self.user_cache_size:
+                self._known_users.popitem(last=False)
+
+            return (user_ids - unseen) | found
+
+        return user_ids
+
+    def _write(self, batch: list[Notification]):
+        known = self._known({notification.user_id for notification in batch})
+
+        docs = []
+
+        for notification in batch:
+            if notification.user_id in known:
+                docs.append(notification.model_dump())
+            else:
+                self.unknown_users += 1
+                logger.info(
+                    f"User {notification.user_id} does not exist, dropping notification {notification.title}")
+
+        if not docs:
+            return
+
+        try:
+            self.get_db()[Collections.notifications].insert_many(
+                docs, ordered=False)
+            duplicates = 0
+
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+
+            if any(error["code"] != DUPLICATE_KEY for error in errors) or e.details.get("writeConcernErrors", None):
+                raise
+
+            # stored by an earlier attempt
+            duplicates = len(errors)
+
+        self.written += len(docs) - duplicates
+        self.duplicates += duplicates
+        self.batches += 1
+
+    def _write_until_stored(self, batch: list[tuple[Notification, Future | None]]):
+        last_attempt = False
+
+        while True:
+            try:
+                self._write([notification for notification, _ in batch])
+
+                for _, stored in batch:
+                    if stored is not None:
+                        stored.set_result(None)
+
+                return
+
+            except Exception as e:
+                self.failures += 1
+
+                if last_attempt:
+                    logger.error(
+                        f"Unable to write {len(batch)} notifications on shutdown, dropping them - {e}")
+
+                    for _, stored in batch:
+                        if stored is not None:
+                            stored.set_exception(e)
+
+                    return
+
+                logger.error(
+                    f"Unable to write {len(batch)} notifications, will retry - {e}")
+                # once stopping, a batch gets one more attempt before it is given up
+                last_attempt = self._stopping.is_set()
+                time.sleep(self.retry_interval)
+
+    def flush(self):
+        "Write everything pending in the calling thread"
+
+        while batch := self._take_batch(0):
+            self._write_until_stored(batch)
+
+    def run(self):
+        while not self._stopping.is_set():
+            batch = self._take_batch(self.flush_interval)
+
+            if batch:
+                self._write_until_stored(batch)
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        with self._start_lock:
+            if self._thread is None:
+                self._stopping.clear()
+                self._thread = threading.Thread(
+                    target=self.run, name="notification-sink", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        "Stop the writer and write whatever is still pending"
+
+        with self._start_lock:
+            if self._thread is not None:
+                self._stopping.set()
+                self._thread.join(timeout)
+                self._thread = None
+
+        self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self),
+            "written": self.written,
+            "batches": self.batches,
+            "duplicates": self.duplicates,
+            "unknown_users": self.unknown_users,
+            "failures": self.failures,
+            "overflowed": self.overflowed,
+        }
+
+
+notification_sink = NotificationSink(settings.notification_batch_size, settings.notification_flush_secs, settings.notification_max_pending,
+                                     settings.notification_retry_secs, settings.notification_user_cache_size)
@@ -1,4 +1,9 @@
 import math
+import asyncio
+import json
+import base64
+from enum import Enum
+from fastapi import HTTPException
 from libs.config.settings import get_settings
 from pydantic_settings import SettingsConfigDict
 from pydantic import BaseModel, Field
@@ -9,6 +14,12 @@ from libs.db import Collections, _db
 settings = get_settings()
 
 
+class CountModes(str, Enum):
+    exact = "exact"
+    capped = "capped"
+    none = "none"
+
+
 class PaginatedResult(BaseModel):
     per_page: int = Field(ge=1, alias="perPage")
     num_items: int = Field(ge=0, alias="numItems")
@@ -19,13 +30,61 @@ class PaginatedResult(BaseModel):
     has_prev: bool = Field(alias="hasPrev")
     num_pages: int = Field(ge=0, alias="numPages")
     items: list[Any]
+    next_cursor: str | None = Field(alias="nextCursor", default=None)
 
     model_config = SettingsConfigDict(populate_by_name=True)
 
 
+class JoinFilter(BaseModel):
+    """ Restrict items to those whose joined document in `from_col` satisfies `match`.
+
+    Compiles to a $lookup + $match so the filtering happens inside the database and
+    is reflected in the totals.
+    """
+
+    from_col: Collections
+    local_field: str
+    foreign_field: str = "uid"
+    match: dict = {}
+    as_field: str = "_joined"
+    keep: bool = False
+
+    def to_stages(self) -> list[dict]:
+        stages = [
+            {"$lookup": {
+                "from": self.from_col.value,
+                "localField": self.local_field,
+                "foreignField": self.foreign_field,
+                "as": self.as_field,
+            }},
+            {"$match": {f"{self.as_field}.{k}": v for k, v in self.match.items()}},
+        ]
+
+        if not self.keep:
+            stages.append({"$project": {self.as_field: 0}})
+
+        return stages
+
+
+def encode_cursor(sort_value: Any, uid: str) -> str:
+    raw = json.dumps([sort_value, uid], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> tuple[Any, str]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        sort_value, uid = json.loads(base64.urlsafe_b64decode(padded))
+
+    except Exception:
+        raise HTTPException(400, "invalid pagination cursor")
+
+    return sort_value, uid
+
+
 class Paginator:
 
-    def __init__(self,   col_name:  Collections,  sort_field: str, top_down_sort: bool = True, per_page: int = 2, filters: dict = {}, include_crumbs=True, filter_func=None,  root_filter: dict = {}) -> None:
+    def __init__(self,   col_name:  Collections,  sort_field: str, top_down_sort: bool = True, per_page: int = 2, filters: dict = {}, include_crumbs=True, filter_func=None,  root_filter: dict = {}, count_mode: CountModes = CountModes.exact, use_aggregation: bool = True, join_filters: list[JoinFilter] = []) -> None:
         self.per_page = per_page
         self.sort_field = sort_field
         self.direction = -1 if top_down_sort else 1
@@ -37,8 +96,17 @@ class Paginator:
         self.init = False
         self.col_name = col_name
         self.root_filter = root_filter
+        self.count_mode = count_mode
+        self.join_filters = join_filters
+
+        # joins can only be expressed in the aggregation backend
+        self.use_aggregation = use_aggregation or bool(join_filters)
 
-        if root_filter:
+        if set(root_filter) & set(filters):
+            # a filter on a key of the root filter narrows it rather than replacing it
+            self.filters = {"$and": [root_filter, filters]}
+
+        elif root_filter:
             self.filters = {**root_filter, **filters}
 
         else:
@@ -47,9 +115,64 @@ class Paginator:
         self.query = None
         self.num_pages = None
         self.filter_func = filter_func
+        self.after = None
+        self.has_more = False
+        self.next_cursor = None
+
+    def _sort_spec(self):
+        # uid breaks ties so that page and cursor boundaries are deterministic
+        return [(self.sort_field, self.direction), ("uid", self.direction)]
+
+    def _make_cursor(self, items):
+        if not items:
+            return None
+
+        last = items[-1]
+        return encode_cursor(last.get(self.sort_field), last.get("uid"))
+
+    def _cursor_bound(self, after: str, behind: bool = False):
+        """ Match the items that follow the one encoded in the cursor, or with `behind` that item
+        and the ones before it. """
+
+        sort_value, uid = decode_cursor(after)
+
+        if behind:
+            op, uid_op = ("$gt", "$gte") if self.direction == -1 else ("$lt", "$lte")
+        else:
+            op = uid_op = "$lt" if self.direction == -1 else "$gt"
+
+        return {"$or": [
+            {self.sort_field: {op: sort_value}},
+            {self.sort_field: sort_value, "uid": {uid_op: uid}},
+        ]}
+
+    def _join_stages(self):
+        stages = []
+
+        for join_filter in self.join_filters:
+            stages.extend(join_filter.to_stages())
+
+        return stages
+
+    def _count_stages(self, match: dict, joined=False):
+        stages = [{"$match": match}]
+
+        if joined:
+            stages.extend(self._join_stages())
+
+        if self.count_mode == CountModes.capped:
+            stages.append({"$limit": settings.paginator_count_cap})
+
+        stages.append({"$count": "n"})
+
+        return stages
+
+    async def get_paginated_result(self, page: int, items_cls=None, exclude_fields=None, after: str | None = None):
+        if after:
+            items = await self.get_page_after(after)
+        else:
+            items = await self.get_page(page)
 
-    async def get_paginated_result(self, page: int, items_cls=None, exclude_fields=None):
-        items = await self.get_page(page)
         mapped_items = [items_cls(**x).model_dump(by_alias=True, exclude=exclude_fields)
                         for x in items] if items_cls else items
 
@@ -62,13 +185,65 @@ class Paginator:
             page=page,
             items=mapped_items,
             entries=self.entries,
-            unfiltered_entries=self.unfiltered_entries
+            unfiltered_entries=self.unfiltered_entries,
+            next_cursor=self.next_cursor,
         )
 
+    async def __run_counts(self):
+        """ Both totals in one $facet over the root filter, which is matched first so it can use an index. """
+
+        facets = {
+            "unfiltered": self._count_stages({}),
+            "entries": self._count_stages(self.filters, joined=True),
+        }
+
+        result = await _db[self.col_name].aggregate([{"$match": self.root_filter}, {"$facet": facets}]).to_list(length=1)
+
+        return result[0] if result else {}
+
+    async def __run_aggregation(self, items_stages: list, items_match: dict | None = None):
+        """ Fetch one window of items and the totals concurrently.
+
+        The items pipeline starts with $match and $sort so that the filter, the sort and any
+        cursor bound are served by an index; a $facet would hide them from the planner.
+        """
+
+        self.init = True
+
+        pipeline = [{"$match": items_match or self.filters}, {"$sort": dict(self._sort_spec())},
+                    *self._join_stages(), *items_stages]
+
+        items_query = _db[self.col_name].aggregate(pipeline).to_list(length=None)
+
+        if self.count_mode == CountModes.none:
+            return await items_query
+
+        items, counts = await asyncio.gather(items_query, self.__run_counts())
+
+        unfiltered = counts.get("unfiltered", [])
+        entries = counts.get("entries", [])
+
+        self.unfiltered_entries = unfiltered[0]["n"] if unfiltered else 0
+        self.entries = entries[0]["n"] if entries else 0
+        self.num_items = self.entries
+
+        return items
+
+    async def __exists(self, match: dict):
+        if self.join_filters:
+            found = await _db[self.col_name].aggregate([{"$match": match}, *self._join_stages(), {"$limit": 1}]).to_list(length=1)
+            return bool(found)
+
+        return await _db[self.col_name].count_documents(match, limit=1) > 0
+
     async def __initialize(self):
         if self.init:
             return
 
+        if self.use_aggregation:
+            await self.get_page(self.current_page)
+            return
+
         self.init = True
 
         self.unfiltered_entries = await _db[self.col_name].count_documents(self.root_filter)
@@ -80,7 +255,7 @@ class Paginator:
         self.num_items = n
 
         self.query = _db[self.col_name].find(
-            self.filters).sort(self.sort_field, self.direction)
+            self.filters).sort(self._sort_spec())
         await self.get_num_pages()
 
     async def get_num_pages(self, refresh=False):
@@ -89,6 +264,12 @@ class Paginator:
             return self.num_pages
 
         await self.__initialize()
+
+        if self.num_items is None:
+            # totals were skipped, so only the pages seen so far are known
+            self.num_pages = self.current_page + (1 if self.has_more else 0)
+            return self.num_pages
+
         n = math.floor(self.num_items/self.per_page)
 
         if self.num_items > (n * self.per_page) and self.include_crumbs:
@@ -98,17 +279,56 @@ class Paginator:
 
         return self.num_pages
 
-    async def get_page(self, page: int):
+    async def __apply_filter_func(self, page_items: list):
+        filtered_items = []
 
-        await self.__initialize()
+        for item in page_items:
+            if await self.filter_func(item):
+                filtered_items.append(item)
+
+        return filtered_items
+
+    async def __get_page_aggregated(self, page: int):
+
+        self.current_page = page
+
+        s_index = (self.per_page * page) - self.per_page
+
+        page_items = await self.__run_aggregation([{"$skip": s_index}, {"$limit": self.per_page + 1}])
+
+        self.has_more = len(page_items) > self.per_page
+        page_items = page_items[:self.per_page]
+
+        await self.get_num_pages(refresh=True)
+
+        if self.filter_func:
+
+            page_items = await self.__apply_filter_func(page_items)
+
+            self.entries = len(page_items)
+            self.num_items = len(page_items)
+            await self.get_num_pages(refresh=True)
+
+        if await self.has_next():
+            self.next_cursor = self._make_cursor(page_items)
+
+        return page_items
+
+    async def get_page(self, page: int):
 
         page = max(1, page)
 
+        if self.use_aggregation:
+            return await self.__get_page_aggregated(page)
+
+        await self.__initialize()
+
         # if page > self.num_pages:
         #     raise HTTPException(
         #         400,  f"page exceeded number of pages ({page} > {self.num_pages})")
 
         if self.num_pages == 1 and page == 1 and not self.filter_func:
+            self.current_page = page
             return await self.query.to_list(length=self.num_items)
 
         if page > self.num_pages:
@@ -125,30 +345,69 @@ class Paginator:
 
         if self.filter_func:
 
-            filtered_items = []
-
-            for item in page_items:
-                if await self.filter_func(item):
-                    filtered_items.append(item)
-
-            page_items = filtered_items
+            page_items = await self.__apply_filter_func(page_items)
 
             self.entries = len(page_items)
             self.num_items = len(page_items)
             await self.get_num_pages(refresh=True)
 
+        if await self.has_next():
+            self.next_cursor = self._make_cursor(page_items)
+
+        return page_items
+
+    async def get_page_after(self, after: str):
+        """ Keyset pagination: fetch the page that follows the item encoded in the `after` cursor.
+
+        The cursor holds the (sort_field, uid) pair of the last item seen, so each page is a
+        single range-bounded query on the sort index regardless of how deep it is.
+        """
+
+        bound = self._cursor_bound(after)
+
+        self.after = after
+
+        if self.use_aggregation:
+            page_items = await self.__run_aggregation([{"$limit": self.per_page + 1}], items_match={"$and": [self.filters, bound]})
+
+        else:
+            await self.__initialize()
+
+            query = _db[self.col_name].find(
+                {"$and": [self.filters, bound]}).sort(self._sort_spec()).limit(self.per_page + 1)
+
+            page_items = await query.to_list(length=self.per_page + 1)
+
+        self.has_more = len(page_items) > self.per_page
+        page_items = page_items[:self.per_page]
+
+        await self.get_num_pages(refresh=True)
+
+        self.next_cursor = self._make_cursor(
+            page_items) if self.has_more else None
+
+        if self.filter_func:
+            page_items = await self.__apply_filter_func(page_items)
+
         return page_items
 
     async def has_next(self):
         if not self.init:
             await self.__initialize()
 
+        if self.after or self.num_items is None:
+            return self.has_more
+
         return self.num_pages > self.current_page
 
     async def has_prev(self):
         if not self.init:
             await self.__initialize()
 
+        if self.after:
+            # the item the cursor points at, or any before it, is still there to go back to
+            return await self.__exists({"$and": [self.filters, self._cursor_bound(self.after, behind=True)]})
+
         return self.current_page > 1
 
     async def next_page(self):
@@ -0,0 +1,169 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from libs.config.settings import get_settings
+from libs.utils.req_helpers import make_req, make_url, handle_response2, Endpoints
+from libs.logging import Logger
+
+
+logger = Logger(f"{__package__}.{__name__}")
+
+settings = get_settings()
+
+
+def load_quore_id_api_token():
+    "Fetch a new access token, returning (token, expires_in_secs) or (None, 0) on failure"
+
+    url = make_url(settings.quore_id_api_url, "/token")
+
+    ok, status, data = make_req(
+        url, "POST", {
+            'Content-Type': 'application/json'
+        }, {
+            "clientId":  settings.quore_id_client_id,
+            "secret": settings.quore_id_secret_key
+        }
+    )
+
+    success = handle_response2(ok, status, data)
+
+    if not success:
+        logger.critical("\n Failed to get QUORE ID TOKEN ")
+        return None, 0
+
+    logger.info("\n Fetched QUORE ID TOKEN successfully ")
+
+    return data["accessToken"], data.get("expiresIn", None) or settings.quore_id_token_default_ttl_secs
+
+
+class AccessTokenCache:
+    """ Holds one access token for the whole process.
+
+    The token is refreshed `refresh_margin` seconds before it expires. Workers that find it stale
+    at the same time wait on a single refresh instead of each fetching their own token.
+    """
+
+    def __init__(self, loader, refresh_margin: float) -> None:
+        self.loader = loader
+        self.refresh_margin = refresh_margin
+        self.token = None
+        self.expires_at = 0.0
+        self.refreshes = 0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self):
+        return self.token is not None and time.monotonic() < self.expires_at - self.refresh_margin
+
+    def get(self, rejected_token: str | None = None) -> str | None:
+        """ Return a usable token.
+
+        Pass the token the API just rejected with a 401 as `rejected_token` to force a refresh,
+        unless another worker has already replaced it.
+        """
+
+        if self._is_fresh() and self.token != rejected_token:
+            return self.token
+
+        with self._lock:
+
+            if self._is_fresh() and self.token != rejected_token:
+                return self.token
+
+            token, expires_in = self.loader()
+
+            self.refreshes += 1
+
+            if token is None:
+                return None
+
+            self.token = token
+            self.expires_at = time.monotonic() + expires_in
+
+            return token
+
+    def stats(self) -> dict:
+        return {
+            "name": "quore_id_token",
+            "ttl_remaining": max(0, round(self.expires_at - time.monotonic())),
+            "refreshes": self.refreshes,
+        }
+
+
+quore_id_token = AccessTokenCache(
+    load_quore_id_api_token, settings.quore_id_token_refresh_margin_secs)
+
+
+def quore_id_req(url: str, method: str, body: dict | None = None):
+    "make_req with the cached QoreID token, refreshing it once if the API rejects it"
+
+    token = quore_id_token.get()
+
+    if token is None:
+        return False, 503, "QUORE ID TOKEN is not ready"
+
+    ok, status, data = make_req(
+        url, method, headers={"Authorization": f"Bearer {token}"}, body=body)
+
+    if status == 401:
+        token = quore_id_token.get(rejected_token=token)
+
+        if token is None:
+            return ok, status, data
+
+        ok, status, data = make_req(
+            url, method, headers={"Authorization": f"Bearer {token}"}, body=body)
+
+    return ok, status, data
+
+
+_verification_pool = ThreadPoolExecutor(
+    max_workers=settings.kyc_verification_workers, thread_name_prefix="qoreid")
+
+
+def _timed(fn, *args, **kwargs):
+    started = time.monotonic()
+    result = fn(*args, **kwargs)
+    return result, round(time.monotonic() - started, 3)
+
+
+def verify_identity(bvn: str, bvn_body: dict, nin: str, nin_body: dict, deadline: float) -> dict:
+    """ Run the BVN match and the NIN lookup concurrently under one deadline.
+
+    Returns the (ok, status, data) response of each lookup under "bvn" and "nin", with the time
+    each one took under "timings". When the BVN lookup fails the NIN lookup is cancelled, or its
+    result ignored, and "nin" is left out. Raises TimeoutError if a lookup misses the deadline.
+    """
+
+    started = time.monotonic()
+
+    pending = {
+        _verification_pool.submit(_timed, quore_id_req, make_url(Endpoints.bvn_verification.value, surfix=f"/{bvn}"), "POST", body=bvn_body): "bvn",
+        _verification_pool.submit(_timed, quore_id_req, make_url(Endpoints.nin_verification.value, surfix=f"/{nin}"), "POST", body=nin_body): "nin",
+    }
+
+    result = {"timings": {}}
+
+    while pending:
+        done, _ = wait(pending, timeout=max(0, deadline - (time.monotonic() - started)),
+                       return_when=FIRST_COMPLETED)
+
+        if not done:
+            for future in pending:
+                future.cancel()
+
+            raise TimeoutError(
+                f"QoreID {', '.join(pending.values())} lookup missed the {deadline}s deadline")
+
+        for future in done:
+            name = pending.pop(future)
+            result[name], result["timings"][name] = future.result()
+
+        # a failed BVN lookup rejects the submission, so the NIN result is not needed
+        if "bvn" in result and not handle_response2(*result["bvn"]):
+            for future in pending:
+                future.cancel()
+
+            result.pop("nin", None)
+            break
+
+    return result
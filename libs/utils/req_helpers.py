@@ -1,4 +1,10 @@
+import time
+import anyio
 import requests
+import threading
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from .resilience import CircuitBreaker, LatencyTracker, jittered_backoff
 from ..config.settings import get_settings
 from enum import Enum
 from ..logging import Logger
@@ -19,6 +25,52 @@ class Endpoints(str, Enum):
     flutterwave_transfers = "https://api.flutterwave.com/v3/transfers"
 
 
+# Per-endpoint total deadline (seconds, across retries) and retry budget. Retries only apply to
+# idempotent calls; payment initiation and transfers are never retried.
+ENDPOINT_POLICIES: dict[Endpoints, dict] = {
+    Endpoints.bvn_verification: {"deadline": 20, "retries": 0, "idempotent": False},
+    Endpoints.nin_verification: {"deadline": 20, "retries": 0, "idempotent": False},
+    Endpoints.flutterwave_payments: {"deadline": 15, "retries": 0, "idempotent": False},
+    Endpoints.flutterwave_tx_verification: {"deadline": 10, "retries": 2, "idempotent": True},
+    Endpoints.flutterwave_get_banks: {"deadline": 10, "retries": 2, "idempotent": True},
+    Endpoints.flutterwave_resolve_bank_account: {"deadline": 10, "retries": 1, "idempotent": True},
+    Endpoints.flutterwave_transfers: {"deadline": 20, "retries": 0, "idempotent": False},
+}
+
+DEFAULT_POLICY = {"deadline": 30, "retries": 0, "idempotent": False}
+
+_breakers: dict[str, CircuitBreaker] = {}
+_trackers: dict[str, LatencyTracker] = {}
+_registry_lock = threading.Lock()
+
+
+def _get_policy(url: str):
+    matches = [endpoint for endpoint in Endpoints if url.startswith(endpoint.value)]
+
+    if matches:
+        endpoint = max(matches, key=lambda e: len(e.value))
+        return endpoint.name, ENDPOINT_POLICIES.get(endpoint, DEFAULT_POLICY)
+
+    return urlparse(url).netloc, DEFAULT_POLICY
+
+
+def _get_guards(name: str):
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name, settings.http_breaker_failure_threshold, settings.http_breaker_reset_secs)
+            _trackers[name] = LatencyTracker()
+
+        return _breakers[name], _trackers[name]
+
+
+def get_external_api_stats() -> dict:
+    with _registry_lock:
+        names = list(_breakers)
+
+    return {name: {**_breakers[name].stats(), **_trackers[name].stats()} for name in names}
+
+
 def handle_response2(ok, status, data, silent=True):
     if not ok:
 
@@ -84,7 +136,34 @@ def make_url(frag, surfix="", skip_base=True):
     return "{0}{1}{2}".format(base_url, frag, surfix)
 
 
-def make_req(url, method, headers={}, body=None):
+def _make_session():
+    # one keep-alive pool per host; pool_block caps concurrent connections per host at pool_maxsize
+    adapter = HTTPAdapter(pool_connections=settings.http_pool_hosts,
+                          pool_maxsize=settings.http_pool_per_host, pool_block=True)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+_session = _make_session()
+
+_limiter = None
+
+
+def _get_limiter():
+    # blocking calls get their own worker threads instead of sharing the default anyio pool used by FastAPI
+    global _limiter
+
+    if _limiter is None:
+        _limiter = anyio.CapacityLimiter(settings.http_max_concurrency)
+
+    return _limiter
+
+
+def make_req(url, method, headers={}, body=None, timeout=None):
     _headers = {
         "accept": "application/json",
         "content-type": "application/json",
@@ -96,8 +175,56 @@ def make_req(url, method, headers={}, body=None):
 
     _headers.update(headers)
 
-    response = requests.request(
-        method=method, url=url, headers=_headers, json=body)
+    name, policy = _get_policy(url)
+    breaker, tracker = _get_guards(name)
+
+    if not breaker.allow():
+        logger.critical(
+            f"External API call to {name} rejected, circuit is open")
+        return False, status_codes.HTTP_503_SERVICE_UNAVAILABLE, f"circuit open for {name}"
+
+    attempts = 1 + (policy["retries"] if policy["idempotent"] else 0)
+    started = time.monotonic()
+    deadline_at = started + policy["deadline"]
+
+    for attempt in range(attempts):
+
+        remaining = max(0.1, deadline_at - time.monotonic())
+
+        error = None
+        response = None
+
+        try:
+            response = _session.request(
+                method=method, url=url, headers=_headers, json=body, timeout=timeout or (min(settings.http_connect_timeout_secs, remaining), min(settings.http_read_timeout_secs, remaining)))
+
+        except requests.RequestException as e:
+            error = e
+
+        failed = error is not None or response.status_code >= 500
+
+        if not failed or attempt == attempts - 1:
+            break
+
+        delay = jittered_backoff(
+            attempt, settings.http_retry_backoff_base_secs, settings.http_retry_backoff_cap_secs)
+
+        if time.monotonic() + delay >= deadline_at:
+            break
+
+        logger.warn(
+            f"External API call to {name} failed, retrying in {delay:.2f}s - {error or response.status_code}")
+        time.sleep(delay)
+
+    tracker.record(time.monotonic() - started, not failed, retries=attempt)
+
+    if failed:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+    if error is not None:
+        raise error
 
     status = response.status_code
     ok = response.ok
@@ -114,3 +241,9 @@ def make_req(url, method, headers={}, body=None):
     data = response.json()
 
     return ok, status, data
+
+
+async def async_make_req(url, method, headers={}, body=None, timeout=None):
+    """ make_req for async route handlers: the request runs on a pooled connection in a worker thread so the event loop is not blocked. """
+
+    return await anyio.to_thread.run_sync(lambda: make_req(url, method, headers=headers, body=body, timeout=timeout), limiter=_get_limiter())
@@ -0,0 +1,114 @@
+import time
+import random
+import threading
+from collections import deque
+
+
+class CircuitBreaker:
+    """ Fails fast after `failure_threshold` consecutive failures.
+
+    Once open, calls are rejected for `reset_timeout` seconds, then a single trial call is let
+    through (half open); its outcome closes or re-opens the breaker. Safe to share across threads.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyTracker:
+    "Keeps the last `window` latencies (in seconds) and call outcomes for percentile reporting"
+
+    def __init__(self, window: int = 500) -> None:
+        self.samples = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool, retries: int = 0):
+        with self._lock:
+            self.samples.append(latency)
+            self.calls += 1
+            self.retries += retries
+
+            if not ok:
+                self.errors += 1
+
+    def percentile(self, p: float, ordered: list | None = None):
+        if ordered is None:
+            with self._lock:
+                ordered = sorted(self.samples)
+
+        if not ordered:
+            return None
+
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return round(ordered[index] * 1000, 2)
+
+    def stats(self) -> dict:
+        with self._lock:
+            ordered = sorted(self.samples)
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "p50_ms": self.percentile(50, ordered),
+            "p95_ms": self.percentile(95, ordered),
+            "p99_ms": self.percentile(99, ordered),
+        }
+
+
+def jittered_backoff(attempt: int, base: float, cap: float) -> float:
+    "Full jitter: a random delay in [0, min(cap, base * 2 ** attempt)]"
+
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
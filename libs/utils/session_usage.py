@@ -0,0 +1,82 @@
+import asyncio
+from pymongo import UpdateOne
+from libs.config.settings import get_settings
+from ..db import _db, Collections
+from ..logging import Logger
+
+
+settings = get_settings()
+
+logger = Logger(f"{__package__}.{__name__}")
+
+
+class SessionUsageBuffer:
+    "Coalesces per-request auth session usage and writes it to auth_sessions in bulk"
+
+    def __init__(self, flush_interval: float, max_pending: int) -> None:
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.flushes = 0
+        self._pending: dict[str, list] = {}
+        self._task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(self, session_id: str, last_used: float, count: int = 1):
+        entry = self._pending.get(session_id, None)
+
+        if entry is None:
+            self._pending[session_id] = [last_used, count]
+        else:
+            entry[0] = max(entry[0], last_used)
+            entry[1] += count
+
+        if len(self._pending) >= self.max_pending and not self._flush_lock.locked():
+            asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        async with self._flush_lock:
+
+            if not self._pending:
+                return
+
+            pending, self._pending = self._pending, {}
+
+            ops = [
+                UpdateOne({"uid": session_id}, {"$max": {"last_used": last_used}, "$inc": {"usage_count": count}})
+                for session_id, (last_used, count) in pending.items()
+            ]
+
+            try:
+                await _db[Collections.authsessions].bulk_write(ops, ordered=False)
+                self.flushes += 1
+
+            except Exception as e:
+                logger.error(
+                    f"Unable to flush usage for {len(ops)} auth sessions, will retry - {e}")
+
+                # put the increments back so that they are retried on the next flush
+                for session_id, (last_used, count) in pending.items():
+                    self.record(session_id, last_used, count)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        await self.flush()
+
+
+session_usage = SessionUsageBuffer(
+    settings.session_usage_flush_secs, settings.session_usage_max_pending)
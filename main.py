@@ -1,8 +1,15 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routers.main import router
 from libs.huey_tasks.config import huey
 from libs.config.settings import get_settings
+from libs.utils.api_helpers import watch_record_caches
+from libs.utils.session_usage import session_usage
+from libs.huey_tasks.task_buffer import task_buffer
+from libs.utils.notification_sink import notification_sink
+from libs.db import ensure_indexes
+from libs.emails.render_template import precompile_templates
 from libs.huey_tasks.tasks import task_send_mail, task_test_huey,  task_initiate_kyc_verification, task_post_user_registration, task_create_notification, task_process_referral_code, task_process_affiliate_code
 
 settings = get_settings()
@@ -63,6 +70,34 @@ app.add_middleware(
 )
 
 
+background_tasks = set()
+
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+@app.on_event("startup")
+async def start_background_workers():
+    precompile_templates()
+
+    run_in_background(watch_record_caches())
+    session_usage.start()
+    task_buffer.start()
+
+    if settings.ensure_indexes_on_startup:
+        run_in_background(ensure_indexes())
+
+
+@app.on_event("shutdown")
+async def flush_write_behind_buffers():
+    await session_usage.stop()
+    await asyncio.to_thread(task_buffer.stop)
+    await asyncio.to_thread(notification_sink.stop)
+
+
 # Root test route
 @app.get("/")
 async def root():
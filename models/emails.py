@@ -0,0 +1,31 @@
+from datetime import datetime
+from pydantic import BaseModel, Field
+from pydantic_settings import SettingsConfigDict
+from libs.utils.pure_functions import *
+from enum import Enum
+
+
+class OutboxEmailStatus(str, Enum):
+    queued = "queued"
+    sent = "sent"
+    failed = "failed"
+    # the connection was lost after the server had the message, it may or may not have been sent
+    unconfirmed = "unconfirmed"
+
+
+class OutboxEmail(BaseModel):
+    uid: str = Field(default_factory=get_uuid4)
+    email_type: str
+    email_to: str | list[str]
+    email_data: dict = Field(default={})
+    domain: str = Field(default="")
+    status: OutboxEmailStatus = Field(default=OutboxEmailStatus.queued)
+    attempts: int = Field(default=0)
+    last_error: str | None = Field(default=None)
+    next_attempt_at: float = Field(default_factory=get_utc_timestamp)
+    sent_at: float | None = Field(default=None)
+    created_at: float = Field(default_factory=get_utc_timestamp)
+    updated_at: float = Field(default_factory=get_utc_timestamp)
+    expires_at: datetime | None = Field(default=None)
+
+    model_config = SettingsConfigDict(populate_by_name=True)
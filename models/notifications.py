@@ -60,6 +60,7 @@ class Notification(BaseModel):
     read_by_avatar_url: str | None = Field(
         alias="readByAvatarUrl", default=None)
     deleted: bool = Field(default=False)
+    dedupe_key: str | None = Field(alias="dedupeKey", default=None)
 
     model_config = SettingsConfigDict(populate_by_name=True)
 
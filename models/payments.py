@@ -21,6 +21,7 @@ class FundSource(str, Enum):
 
 class TransactionStatus(str, Enum):
     pending = "pending"
+    processing = "processing"
     failed = "failed"
     successful = "successful"
 
@@ -101,3 +102,27 @@ class Transaction(BaseTransactionModel):
     pass
 
     model_config = SettingsConfigDict(populate_by_name=True)
+
+
+class PaymentEventStatus(str, Enum):
+    queued = "queued"
+    processed = "processed"
+    ignored = "ignored"
+    failed = "failed"
+
+
+# Flutterwave webhook event, stored before it is acknowledged so that no event is lost
+class PaymentEvent(BaseModel):
+    uid:  str = Field(default_factory=get_uuid4)
+    event_key: str
+    event_type: str = Field(default="")
+    tx_ref: str | None = Field(default=None)
+    tx_id: str | None = Field(default=None)
+    reported_status: str = Field(default="")
+    payload: dict = Field(default={})
+    status: PaymentEventStatus = Field(default=PaymentEventStatus.queued)
+    result: str | None = Field(default=None)
+    created_at:  float = Field(default_factory=get_utc_timestamp)
+    processed_at:  float | None = Field(default=None)
+
+    model_config = SettingsConfigDict(populate_by_name=True)
@@ -0,0 +1,25 @@
+from datetime import datetime, timedelta, timezone
+from pydantic import BaseModel, Field
+from libs.config.settings import get_settings
+from pydantic_settings import SettingsConfigDict
+from libs.utils.pure_functions import *
+
+
+settings = get_settings()
+
+
+class DeadLetterTask(BaseModel):
+    uid: str = Field(default_factory=get_uuid4)
+    task_id: str
+    task_name: str
+    queue: str
+    args: str = Field(default="")
+    kwargs: str = Field(default="")
+    error: str = Field(default="")
+    traceback: str = Field(default="")
+    failed_at: float = Field(default_factory=get_utc_timestamp)
+    # a date, for the TTL index
+    expires_at: datetime = Field(default_factory=lambda: datetime.now(
+        tz=timezone.utc) + timedelta(days=settings.task_dead_letter_retention_days))
+
+    model_config = SettingsConfigDict(populate_by_name=True)
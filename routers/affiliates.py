@@ -9,7 +9,9 @@ from models.payments import Transaction, TransactionDirection, FundSource, Trans
 from models.users import UserRoles
 from models.wallets import Wallet
 from models.notifications import NotificationTypes
-from libs.huey_tasks.tasks import task_send_mail, task_create_notification
+from libs.huey_tasks.tasks import task_send_mail
+from libs.huey_tasks.task_buffer import task_buffer
+from libs.utils.notification_sink import notification_sink
 from libs.deps.users import get_auth_context, only_paid_users, get_user_wallet, only_affiliates
 from libs.utils.pagination import Paginator, PaginatedResult
 from libs.logging import Logger
@@ -36,10 +38,10 @@ async def enable_affiliate_on_account(auth_context: AuthenticationContext = Depe
 
         await update_record(UserDBModel, auth_context.user.model_dump(), Collections.users, "uid", auth_context.user.uid)
 
-        task_send_mail("welcome_to_affiliates", auth_context.user.email, {
+        task_buffer.submit(task_send_mail, "welcome_to_affiliates", auth_context.user.email, {
             "first_name": auth_context.user.first_name})
 
-        task_create_notification(
+        notification_sink.add(
             auth_context.user.uid, NotificationTypes.account, "Your account has been enabled for affiliates.", "Your account has been enabled for affiliates. You can now start referring people to the platform and earn commissions.")
 
         return {"message": "You have successfully enabled your account for affiliates!"}
@@ -148,8 +150,8 @@ async def withdraw_affiliate_bonus(auth_context: AuthenticationContext = Depends
 
     # Send email to applicant
 
-    task_send_mail("affiliate_withdrawal", auth_context.user.email,
-                   {"first_name":  auth_context.user.first_name, "amount": amount})
+    task_buffer.submit(task_send_mail, "affiliate_withdrawal", auth_context.user.email,
+                       {"first_name":  auth_context.user.first_name, "amount": amount})
 
     transaction = Transaction(
         initiator=auth_context.user.uid,
@@ -166,7 +168,7 @@ async def withdraw_affiliate_bonus(auth_context: AuthenticationContext = Depends
 
     await _db[Collections.wallets].update_one({"user_id": auth_context.user.uid}, {"$set": user_wallet.model_dump()})
 
-    task_create_notification(
+    notification_sink.add(
         auth_context.user.uid, NotificationTypes.affiliate, "Affiliate Bonus Deposited", f"We have transferred your affiliate bonus of {amount}  into your wallet.")
 
     return transaction
@@ -2,15 +2,16 @@ from fastapi import APIRouter, HTTPException, Depends, Query
 from libs.config.settings import get_settings
 from models.users import AuthenticationContext
 from libs.db import _db, Collections
-from libs.utils.api_helpers import find_record, update_record
+from libs.utils.api_helpers import find_record, update_record, hydrate_records
 from models.payments import Transaction
 from libs.utils.flutterwave import _initiate_payment
 from models.payments import *
 from models.investments import *
 from models.wallets import Wallet
 from libs.utils.pure_functions import *
-from libs.utils.pagination import Paginator, PaginatedResult
-from libs.huey_tasks.tasks import task_send_mail, task_create_notification
+from libs.utils.pagination import Paginator, PaginatedResult, JoinFilter
+from libs.huey_tasks.tasks import task_send_mail
+from libs.utils.notification_sink import notification_sink
 from models.notifications import NotificationTypes
 from libs.deps.users import get_auth_context, get_user_wallet, only_paid_users, only_kyc_verified_users
 from libs.logging import Logger
@@ -76,13 +77,13 @@ async def get_investible_assets(page: int = 1, limit: int = 10, owners_club:  Ow
 @router.get("/investibles/{uid}", status_code=200, response_model=InvestibleAsset)
 async def get_investible_asset(uid: str, auth_context: AuthenticationContext = Depends(get_auth_context)):
 
-    asset = await _db[Collections.investible_assets].find_one({"uid": uid})
+    asset: InvestibleAsset = await find_record(InvestibleAsset, Collections.investible_assets, "uid", uid, raise_404=False)
 
     if not asset:
         raise HTTPException(status_code=404,
                             detail="The investment asset you requested does not exist!")
 
-    return InvestibleAsset(**asset)
+    return asset
 
 
 @router.post("/investibles/invest", status_code=200, response_model=TopupOutput | None)
@@ -92,7 +93,8 @@ async def create_investment(body: InvestmentInput, auth_context: AuthenticationC
         raise HTTPException(status_code=400,
                             detail="You cannot create an investment as you do not have a wallet.")
 
-    asset: InvestibleAsset = await find_record(InvestibleAsset, Collections.investible_assets, "uid", body.asset_uid, raise_404=False)
+    # available units are decremented below, so read them fresh rather than from the cache
+    asset: InvestibleAsset = await find_record(InvestibleAsset, Collections.investible_assets, "uid", body.asset_uid, raise_404=False, use_cache=False)
 
     if not asset:
         raise HTTPException(status_code=404,
@@ -150,7 +152,7 @@ async def create_investment(body: InvestmentInput, auth_context: AuthenticationC
         # update the investment
         investment.is_active = True
 
-        task_create_notification(
+        notification_sink.add(
             investment.investor_uid, NotificationTypes.investment, "Investment Successful", f"You invested {transaction.amount} in {asset.asset_name}")
 
         await _db[Collections.investments].insert_one(investment.model_dump())
@@ -160,7 +162,7 @@ async def create_investment(body: InvestmentInput, auth_context: AuthenticationC
 
         # initiate the transaction on flutterwave
 
-        result = _initiate_payment(transaction, auth_context, customizations={
+        result = await _initiate_payment(transaction, auth_context, customizations={
             "title": "SafeHome",
             "description": "Investment in SafeHome",
         })
@@ -188,11 +190,11 @@ async def get_my_investments(page: int = 1, limit: int = 10, owners_club:  Owner
 
     filters = {}
 
-    async def filter_for_items_with_correct_owner_club(item,):
+    join_filters = []
 
-        asset = await _db[Collections.investible_assets].find_one({"uid":  item["asset_uid"]})
-
-        return asset["owner_club"] == owners_club.value
+    if owners_club != OwnersClubs.all:
+        join_filters.append(JoinFilter(
+            from_col=Collections.investible_assets, local_field="asset_uid", match={"owner_club": owners_club.value}))
 
     paginator = Paginator(
         col_name=Collections.investments,
@@ -202,7 +204,7 @@ async def get_my_investments(page: int = 1, limit: int = 10, owners_club:  Owner
         top_down_sort=True,
         include_crumbs=True,
         per_page=limit,
-        filter_func=filter_for_items_with_correct_owner_club if owners_club != OwnersClubs.all else None,
+        join_filters=join_filters,
     )
 
     result = await paginator.get_paginated_result(page, InvestmentWithAsset)
@@ -210,12 +212,8 @@ async def get_my_investments(page: int = 1, limit: int = 10, owners_club:  Owner
     # get the asset for each investment and set it to the asset info propert of each item in the result
 
     if include_asset:
-        for item in result.items:
-
-            asset = await _db[Collections.investible_assets].find_one({"uid":  item['assetUid']})
-
-            item['assetInfo'] = InvestibleAsset(
-                **asset).model_dump(by_alias=True)
+        await hydrate_records(result.items, InvestibleAsset,
+                              Collections.investible_assets, "assetUid", "assetInfo")
 
     return result
 
@@ -269,12 +267,8 @@ async def get_investments_for_asset(uid: str, page: int = 1, limit: int = 10, au
 
     # get the asset for each investment and set it to the asset info propert of each item in the result
 
-    for item in result.items:
-
-        asset = await _db[Collections.investible_assets].find_one({"uid":  item['assetUid']})
-
-        item['assetInfo'] = InvestibleAsset(
-            **asset).model_dump(by_alias=True)
+    await hydrate_records(result.items, InvestibleAsset,
+                          Collections.investible_assets, "assetUid", "assetInfo")
 
     return result
 
@@ -293,9 +287,8 @@ async def get_investment(uid: str, auth_context: AuthenticationContext = Depends
         raise HTTPException(status_code=403,
                             detail="You are not authorized to view this investment!")
 
-    asset = await _db[Collections.investible_assets].find_one({"uid":  investment["asset_uid"]})
+    asset: InvestibleAsset = await find_record(InvestibleAsset, Collections.investible_assets, "uid", investment["asset_uid"])
 
-    investment["assetInfo"] = InvestibleAsset(
-        **asset).model_dump(by_alias=True)
+    investment["assetInfo"] = asset.model_dump(by_alias=True)
 
     return InvestmentWithAsset(**investment)
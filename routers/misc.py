@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+from fastapi import APIRouter, HTTPException, Header, Depends
 from libs.config.settings import get_settings
 from libs.utils.pure_functions import get_uuid4
 from models.misc import *
@@ -6,10 +7,18 @@ from libs.db import _db, Collections
 from libs.utils.api_helpers import find_record
 from libs.utils.pure_functions import *
 from libs.huey_tasks.tasks import task_send_mail
+from libs.huey_tasks.task_buffer import task_buffer
+from libs.huey_tasks.config import QUEUES
+from libs.huey_tasks.metrics import task_metrics, task_report
+from libs.utils.notification_sink import notification_sink
 from libs.utils.security import generate_totp, validate_totp
 from models.users import ActionIdentifiers
 from models.investments import InvestibleAsset
 from libs.db import _db, Collections
+from libs.utils.req_helpers import get_external_api_stats
+from libs.utils.api_helpers import RECORD_CACHES
+from libs.utils.flutterwave import bank_catalog, bank_account_cache
+from libs.deps.users import auth_cache
 
 
 settings = get_settings()
@@ -33,8 +42,8 @@ async def confirm_waitlist_email(body:  WaitlistEmailConfirmationInput):
 
     # Send email to applicant
 
-    task_send_mail("waitlist_email_confirmation", body.email,
-                   {"otp": otp, "uid": uid})
+    task_buffer.submit(task_send_mail, "waitlist_email_confirmation", body.email,
+                       {"otp": otp, "uid": uid})
 
     return {
         "uid": uid,
@@ -69,12 +78,56 @@ async def add_waitlist_applicant(body:  WaitlistApplicationInput):
 
     # Send email to applicant
 
-    task_send_mail("joined_waitlist", application.email,
-                   {"full_name":  application.full_name})
+    task_buffer.submit(task_send_mail, "joined_waitlist", application.email,
+                       {"full_name":  application.full_name})
 
     return {"message": "Application submitted successfully!"}
 
 
+async def only_metrics_clients(api_key: str | None = Header(default=None, alias=settings.api_key_header_name)):
+
+    if settings.debug:
+        return True
+
+    if not settings.metrics_api_key or api_key != settings.metrics_api_key:
+        raise HTTPException(status_code=403, detail="Invalid api key")
+
+    return True
+
+
+@router.get("/metrics", status_code=200, dependencies=[Depends(only_metrics_clients)])
+async def get_metrics():
+
+    caches = [cache.stats() for cache in RECORD_CACHES.values()]
+    caches += [auth_cache.stats(), bank_account_cache.stats(),
+               bank_catalog.stats()]
+
+    email_outbox = {}
+
+    async for row in _db[Collections.email_outbox].aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+        email_outbox[row["_id"]] = row["count"]
+
+    return {
+        "external_apis": get_external_api_stats(),
+        "caches": caches,
+        "email_outbox": email_outbox,
+        "task_buffer": task_buffer.stats(),
+        "notification_sink": notification_sink.stats(),
+    }
+
+
+@router.get("/metrics/tasks", status_code=200, dependencies=[Depends(only_metrics_clients)])
+async def get_task_metrics(hours: int = settings.task_metrics_report_hours):
+    return await asyncio.to_thread(task_report, task_metrics.get_db(), QUEUES, hours)
+
+
+@router.get("/metrics/tasks/dead-letters", status_code=200, dependencies=[Depends(only_metrics_clients)])
+async def get_task_dead_letters(task_name: str | None = None, limit: int = 20):
+    query = {"task_name": task_name} if task_name else {}
+
+    return await _db[Collections.task_dead_letters].find(query, {"_id": 0}).sort("failed_at", -1).limit(min(limit, 100)).to_list(length=None)
+
+
 @router.post("/de/assets", status_code=201)
 async def add_de_asset(body:  DEAssetInput, q:  int = 1):
 
@@ -5,7 +5,7 @@ from libs.db import _db, Collections
 from libs.utils.pure_functions import *
 from libs.deps.users import AuthenticationContext, get_auth_context, only_paid_users
 from libs.utils.api_helpers import update_record, find_record
-from libs.utils.pagination import Paginator, PaginatedResult
+from libs.utils.pagination import Paginator, PaginatedResult, CountModes
 
 
 settings = get_settings()
@@ -39,7 +39,7 @@ async def get_user_notifications_stats(auth_context: AuthenticationContext = Dep
 
 
 @router.get("", status_code=200, response_model=PaginatedResult)
-async def get_user_notifications(page: int = 1, limit: int = 10, read: bool = Query(default=False),  match: str = Query(default=""), type: NotificationTypes = Query(default="all"), auth_context: AuthenticationContext = Depends(get_auth_context)):
+async def get_user_notifications(page: int = 1, limit: int = 10, read: bool = Query(default=False),  match: str = Query(default=""), type: NotificationTypes = Query(default="all"), after: str | None = Query(default=None), auth_context: AuthenticationContext = Depends(get_auth_context)):
 
     root_filter = {
         "user_id": auth_context.user.uid,
@@ -67,9 +67,9 @@ async def get_user_notifications(page: int = 1, limit: int = 10, read: bool = Qu
         filters["read"] = read
 
     paginator = Paginator(Collections.notifications,
-                          "created_at", top_down_sort=True,  root_filter=root_filter, filters=filters, per_page=limit)
+                          "created_at", top_down_sort=True,  root_filter=root_filter, filters=filters, per_page=limit, count_mode=CountModes.capped)
 
-    res = await paginator.get_paginated_result(page, Notification)
+    res = await paginator.get_paginated_result(page, Notification, after=after)
     return res
 
 
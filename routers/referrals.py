@@ -8,7 +8,9 @@ from libs.utils.pure_functions import *
 from models.payments import Transaction, TransactionDirection, FundSource, TransactionStatus, TransactionType
 from models.notifications import NotificationTypes
 from models.wallets import Wallet
-from libs.huey_tasks.tasks import task_send_mail, task_create_notification
+from libs.huey_tasks.tasks import task_send_mail
+from libs.huey_tasks.task_buffer import task_buffer
+from libs.utils.notification_sink import notification_sink
 from libs.deps.users import get_auth_context,  only_paid_users, get_user_wallet, only_kyc_verified_users
 from libs.utils.pagination import Paginator, PaginatedResult
 from libs.logging import Logger
@@ -85,8 +87,8 @@ async def withdraw_referral_bonus(auth_context: AuthenticationContext = Depends(
 
     # Send email to applicant
 
-    task_send_mail("referral_withdrawal", auth_context.user.email,
-                   {"first_name":  auth_context.user.first_name, "amount": amount})
+    task_buffer.submit(task_send_mail, "referral_withdrawal", auth_context.user.email,
+                       {"first_name":  auth_context.user.first_name, "amount": amount})
 
     transaction = Transaction(
         initiator=auth_context.user.uid,
@@ -103,7 +105,7 @@ async def withdraw_referral_bonus(auth_context: AuthenticationContext = Depends(
 
     await _db[Collections.wallets].update_one({"user_id": auth_context.user.uid}, {"$set": user_wallet.model_dump()})
 
-    task_create_notification(
+    notification_sink.add(
         auth_context.user.uid, NotificationTypes.referral, "Referral Bonus Deposited", f"We have transferred your referral bonus of {amount}  into your wallet.")
 
     return transaction
@@ -2,7 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends, Query
 from libs.config.settings import get_settings
 from models.users import AuthenticationContext
 from libs.db import _db, Collections
-from libs.utils.api_helpers import find_record, update_record
+from libs.utils.api_helpers import find_record, update_record, hydrate_records
 from models.payments import Transaction
 from libs.utils.flutterwave import _initiate_payment
 from models.payments import *
@@ -11,7 +11,8 @@ from models.investments import InvestibleAsset
 from models.wallets import Wallet
 from libs.utils.pure_functions import *
 from libs.utils.pagination import Paginator, PaginatedResult
-from libs.huey_tasks.tasks import task_send_mail, task_create_notification
+from libs.huey_tasks.tasks import task_send_mail
+from libs.utils.notification_sink import notification_sink
 from models.notifications import NotificationTypes
 from libs.deps.users import get_auth_context, get_user_wallet, only_paid_users, only_kyc_verified_users
 from libs.logging import Logger
@@ -69,7 +70,7 @@ async def create_goal_savings_plan(body:  GoalSavingsPlanInput, auth_context:  A
 
     await _db[Collections.goal_savings_plans].insert_one(savings_plan.model_dump())
 
-    task_create_notification(
+    notification_sink.add(
         auth_context.user.uid, NotificationTypes.savings, "Savings Plan Created", f"You created a goal savings plan for {savings_plan.goal_name}.")
 
     return savings_plan
@@ -172,7 +173,7 @@ async def fund_goal_savings_plan(body:  FundSavingsInput, auth_context:  Authent
 
         await _db[Collections.transactions].insert_one(transaction.model_dump())
 
-        task_create_notification(
+        notification_sink.add(
             auth_context.user.uid, NotificationTypes.savings, "Savings Plan Funded", f"You funded a goal savings plan for {savings_plan.goal_name}.")
 
     elif body.fund_source == FundSource.bank_account:
@@ -182,7 +183,7 @@ async def fund_goal_savings_plan(body:  FundSavingsInput, auth_context:  Authent
         transaction.status = TransactionStatus.pending
 
         # initiate payment
-        result = _initiate_payment(transaction, auth_context, customizations={
+        result = await _initiate_payment(transaction, auth_context, customizations={
             "title": f"Fund Savings Plan - {savings_plan.goal_name}",
             "description": f"Fund Savings Plan - {savings_plan.goal_name}"
 
@@ -237,7 +238,7 @@ async def create_locked_savings_plan(body:  LockedSavingsPlanInput, auth_context
 
     await _db[Collections.locked_savings_plans].insert_one(savings_plan.model_dump())
 
-    task_create_notification(
+    notification_sink.add(
         auth_context.user.uid, NotificationTypes.savings, "Locked Savings Plan Created", f"You created a locked savings plan for {savings_plan.lock_name}.")
 
     return savings_plan
@@ -293,12 +294,8 @@ async def get_my_locked_savings_plans(auth_context:  AuthenticationContext = Dep
     # get the asset for each investment and set it to the asset info property of each item in the result
 
     if include_asset:
-        for item in result.items:
-
-            asset = await _db[Collections.investible_assets].find_one({"uid":  item['assetUid']})
-
-            item['assetInfo'] = InvestibleAsset(
-                **asset).model_dump(by_alias=True)
+        await hydrate_records(result.items, InvestibleAsset,
+                              Collections.investible_assets, "assetUid", "assetInfo")
 
     return result
 
@@ -393,7 +390,7 @@ async def fund_goal_savings_plan(body:  FundSavingsInput, auth_context:  Authent
 
         await _db[Collections.transactions].insert_one(transaction.model_dump())
 
-        task_create_notification(
+        notification_sink.add(
             auth_context.user.uid, NotificationTypes.savings, "Locked Savings Plan Funded", f"You funded a locked savings plan for {savings_plan.lock_name}.")
 
     elif body.fund_source == FundSource.bank_account:
@@ -403,7 +400,7 @@ async def fund_goal_savings_plan(body:  FundSavingsInput, auth_context:  Authent
         transaction.status = TransactionStatus.pending
 
         # initiate payment
-        result = _initiate_payment(transaction, auth_context, customizations={
+        result = await _initiate_payment(transaction, auth_context, customizations={
             "title": f"Fund Savings Plan - {savings_plan.lock_name}",
             "description": f"Fund Savings Plan - {savings_plan.lock_name}"
 
@@ -5,10 +5,12 @@ from libs.db import _db, Collections
 from libs.utils.pure_functions import *
 from libs.utils.security import scrypt_hash
 from libs.utils.api_helpers import update_record, find_record, _validate_email_from_db, _validate_phone_from_db
-from libs.huey_tasks.tasks import task_send_mail, task_initiate_kyc_verification, task_post_user_registration, task_create_notification
+from libs.huey_tasks.tasks import task_send_mail, task_initiate_kyc_verification, task_post_user_registration
+from libs.huey_tasks.task_buffer import task_buffer
+from libs.utils.notification_sink import notification_sink
 from models.notifications import NotificationTypes
 from libs.utils.security import generate_totp, validate_totp, encode_to_base64, scrypt_verify, _create_access_token
-from libs.deps.users import get_auth_context, get_auth_code, only_paid_users, only_kyc_verified_users
+from libs.deps.users import get_auth_context, get_auth_code, only_paid_users, only_kyc_verified_users, invalidate_auth_cache
 from fastapi.security import OAuth2PasswordRequestForm
 from libs.utils.security import encrypt, encrypt_string
 from libs.cloudinary.uploader import upload_image
@@ -51,7 +53,7 @@ async def user_sign_up(response:  Response, body:  UserInputModel):
 
     # Queue additinonal tasks
 
-    task_post_user_registration(user_db.uid)
+    task_buffer.submit(task_post_user_registration, user_db.uid)
 
     # create verify email auth code
 
@@ -103,7 +105,7 @@ async def update_user(body:  UserUpdateModel, paid_membership_fee: bool = Depend
 
     updated_user = await update_record(UserDBModel, user.model_dump(), Collections.users, "uid", refresh_from_db=True)
 
-    task_create_notification(
+    notification_sink.add(
         user.uid, NotificationTypes.account, "Profile Updated", f"You updated your profile", )
 
     return updated_user
@@ -131,7 +133,7 @@ async def email_verify(body: RequestEmailOrSMSVerificationInput, auth_code:  Aut
 
     url = f"{settings.app_url}/verify-email/{user.email}?uid={uid}&token={encode_to_base64(otp)}&authCode={auth_code.code}"
 
-    task_send_mail(
+    task_buffer.submit(task_send_mail,
         "verify_email", user.email, {"otp": otp, "url": url})
 
     if settings.debug:
@@ -169,7 +171,7 @@ async def email_confirm(body: VerifyEmailOrSMSConfirmationInput):
 
     url = f"{settings.app_url}/kyc?uid={user.uid}&authCode={kyc_doc_auth_code.code}"
 
-    task_send_mail(
+    task_buffer.submit(task_send_mail,
         "verify_email_done", user.email, {"url": url})
 
     return kyc_doc_auth_code
@@ -218,7 +220,7 @@ async def sign_in(body:  OAuth2PasswordRequestForm = Depends()):
 
     # send email
 
-    task_send_mail(
+    task_buffer.submit(task_send_mail,
         "sign_in_notification", user.email, {"support_email": settings.support_email})
 
     return {
@@ -239,7 +241,11 @@ async def sign_out(auth_context:  AuthenticationContext = Depends(get_auth_conte
 
     auth_context.session.is_valid = False
 
-    await update_record(AuthSession, auth_context.session.model_dump(), Collections.authsessions, "uid")
+    # only the fields signing out changes, the usage counters are $inc'ed by the session usage buffer
+    await _db[Collections.authsessions].update_one({"uid": auth_context.session.uid}, {
+        "$set": {"is_valid": False, "updated_at": get_utc_timestamp()}})
+
+    invalidate_auth_cache(session_id=auth_context.session.uid)
 
     # await update_record(UserDBModel, auth_context.user.model_dump(), Collections.users, "uid")
 
@@ -283,12 +289,14 @@ async def change_password(body:  PasswordChangeInput,  paid_membership_fee: bool
 
     await _db[Collections.authsessions].update_many({"user_id": user.uid}, {"$set": {"is_valid": False}})
 
-    task_create_notification(
+    invalidate_auth_cache(user_id=user.uid)
+
+    notification_sink.add(
         user.uid, NotificationTypes.security, "Password Changed", f"You recently changed your password")
 
     # send email
 
-    task_send_mail(
+    task_buffer.submit(task_send_mail,
         "password_changed", user.email, {"first_name": user.first_name, "support_email":  settings.support_email, "reset_link": f"{settings.app_url}/password/reset"})
 
 
@@ -331,7 +339,7 @@ async def password_reset(body:  RequestPasswordResetInput):
 
     url = f"{settings.app_url}/password/save?uid={user.uid}&token={token}"
 
-    task_send_mail(
+    task_buffer.submit(task_send_mail,
         "reset_password", user.email, {"url": url, "first_name": user.first_name})
 
     if settings.debug:
@@ -379,7 +387,7 @@ async def password_save(body:  PasswordResetSaveInput):
 
     await _db[Collections.passwordresetstores].delete_one({"user_id": user.uid, "token": body.token})
 
-    task_send_mail(
+    task_buffer.submit(task_send_mail,
         "reset_password_done", user.email, {"first_name": user.first_name, "support_email":  settings.support_email})
 
 
@@ -420,14 +428,14 @@ async def set_next_of_kin(body:  NextOfKinInput,  paid_membership_fee: bool = De
     if not existing_next_of_kin:
         await _db[Collections.next_of_kins].insert_one(next_of_kin.model_dump())
         # send a notification
-        task_create_notification(
+        notification_sink.add(
             user.uid, NotificationTypes.account, "Next of Kin Added", f"You added a next of kin", )
         return
 
     if body.replace:
         # send a notification
 
-        task_create_notification(
+        notification_sink.add(
             user.uid, NotificationTypes.account, "Next of Kin Updated", f"You  updated your next of kin")
 
         await _db[Collections.next_of_kins].update_one(
@@ -447,7 +455,7 @@ async def set_security_questions(body:  UserSecurityQuestionsInput,  paid_member
     if body.replace:
         # send a notification
 
-        task_create_notification(
+        notification_sink.add(
             user.uid,  NotificationTypes.account, "Security Questions Updated", f"You updated your security questions")
 
         user.security_questions = input_data
@@ -455,7 +463,7 @@ async def set_security_questions(body:  UserSecurityQuestionsInput,  paid_member
     elif user.security_questions is None:
         # send a notification
 
-        task_create_notification(
+        notification_sink.add(
             user.uid, NotificationTypes.account, "Security Questions Added", f"You have added security questions")
 
         user.security_questions = input_data
@@ -531,7 +539,7 @@ async def kyc_doc_upload(file: UploadFile = File(...),  paid_membership_fee: boo
 
     await update_record(UserDBModel, user.model_dump(), Collections.users, "uid")
 
-    task_initiate_kyc_verification(user.uid)
+    task_buffer.submit(task_initiate_kyc_verification, user.uid)
 
 
 @router.get("/mock-kyc", status_code=200, )
@@ -544,8 +552,9 @@ async def mock_kyc(auth_context:  AuthenticationContext = Depends(get_auth_conte
 
     if user.kyc_status == KYCStatus.APPROVED:
         await _db[Collections.users].update_one({"uid": user.uid}, {"$set": {"kyc_status": KYCStatus.PENDING}})
+        invalidate_auth_cache(user_id=user.uid)
 
-    task_initiate_kyc_verification(user.uid)
+    task_buffer.submit(task_initiate_kyc_verification, user.uid)
 
 
 """
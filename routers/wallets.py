@@ -1,18 +1,16 @@
 from fastapi import APIRouter, HTTPException, Depends,  Request, Query
-from fastapi.responses import RedirectResponse
 from libs.config.settings import get_settings
 from models.users import AuthenticationContext
 from libs.db import _db, Collections
-from libs.utils.api_helpers import find_record, update_record
-from libs.utils.pagination import Paginator, PaginatedResult
+from libs.utils.api_helpers import find_record
+from libs.utils.pagination import Paginator, PaginatedResult, CountModes
 from models.payments import *
 from models.wallets import *
 from libs.utils.pure_functions import *
-from libs.huey_tasks.tasks import task_send_mail, task_create_notification
-from models.notifications import NotificationTypes
+from libs.huey_tasks.tasks import task_send_mail
 from libs.deps.users import get_auth_context, get_user_wallet, only_paid_users, only_kyc_verified_users
 from libs.logging import Logger
-from libs.utils.flutterwave import _initiate_topup_payment, _verify_transaction, _get_supported_banks, _resolve_bank_account, _initiate_withdrawal
+from libs.utils.flutterwave import _initiate_topup_payment, _get_payment_redirect, _get_supported_banks, _get_bank_name, _resolve_bank_account, _initiate_withdrawal
 from libs.utils.security import encrypt_string
 from libs.utils.pagination import Paginator, PaginatedResult
 
@@ -102,21 +100,19 @@ async def delete_card(card_id: str, auth_context: AuthenticationContext = Depend
 @router.post("/banks", status_code=201)
 async def add_bank_account(body:  BankAccountInput,  paid_membership_fee: bool = Depends(only_paid_users), auth_context: AuthenticationContext = Depends(get_auth_context), wallet:  Wallet = Depends(get_user_wallet), kyced: bool = Depends(only_kyc_verified_users)):
 
-    account_result = _resolve_bank_account(body.bank_code, body.account_number)
-    banks_result = _get_supported_banks()
-
-    bank_from_results = next(
-        (bank for bank in banks_result if bank["code"] == body.bank_code), None)
+    bank_name = await _get_bank_name(body.bank_code)
 
-    if not bank_from_results:
+    if not bank_name:
         logger.error(f"Invalid bank code - {body.bank_code}")
         raise HTTPException(
             status_code=400, detail="Invalid bank code")
 
+    account_result = await _resolve_bank_account(body.bank_code, body.account_number)
+
     bank_account = BankAccount(
         user_id=auth_context.user.uid,
         wallet=wallet.uid,
-        bank_name=bank_from_results["name"],
+        bank_name=bank_name,
         account_name=account_result["account_name"],
         account_number=account_result["account_number"],
         bank_code=body.bank_code,
@@ -137,13 +133,13 @@ async def get_bank_accounts(auth_context: AuthenticationContext = Depends(get_au
 
 @router.get("/banks/supported", status_code=200, response_model=list[SupportedBank])
 async def get_supported_banks(auth_context: AuthenticationContext = Depends(get_auth_context),  paid_membership_fee: bool = Depends(only_paid_users),):
-    return _get_supported_banks()
+    return await _get_supported_banks()
 
 
 @router.post("/banks/resolve", status_code=200, response_model=ResolveBankAccountOutput)
 async def resolve_bank_account(body: BankAccountInput,  auth_context: AuthenticationContext = Depends(get_auth_context),  paid_membership_fee: bool = Depends(only_paid_users)):
 
-    result = _resolve_bank_account(body.bank_code, body.account_number)
+    result = await _resolve_bank_account(body.bank_code, body.account_number)
 
     resolved_bank = ResolveBankAccountOutput(
         **result
@@ -197,7 +193,7 @@ async def get_wallet(auth_context: AuthenticationContext = Depends(get_auth_cont
 
 
 @router.get("/transactions", status_code=200, response_model=PaginatedResult)
-async def get_wallet_transactions(page: int = Query(ge=1, default=1), limit: int = Query(ge=1, default=1), start_date: float | None = Query(alias="startDate", default=None), end_date: float | None = Query(alias="endDate", default=None), tx_type: str = Query(alias="type", default="all"), from_last: FromLastNTime | None = Query(alias="fromLast", default=None),  paid_membership_fee: bool = Depends(only_paid_users), match: str = Query(default=""), auth_context: AuthenticationContext = Depends(get_auth_context), wallet:  Wallet = Depends(get_user_wallet)):
+async def get_wallet_transactions(page: int = Query(ge=1, default=1), limit: int = Query(ge=1, default=1), start_date: float | None = Query(alias="startDate", default=None), end_date: float | None = Query(alias="endDate", default=None), tx_type: str = Query(alias="type", default="all"), from_last: FromLastNTime | None = Query(alias="fromLast", default=None),  paid_membership_fee: bool = Depends(only_paid_users), match: str = Query(default=""), after: str | None = Query(default=None), auth_context: AuthenticationContext = Depends(get_auth_context), wallet:  Wallet = Depends(get_user_wallet)):
 
     if not wallet:
         logger.error(f"User {auth_context.user.uid} does not have a wallet")
@@ -255,9 +251,10 @@ async def get_wallet_transactions(page: int = Query(ge=1, default=1), limit: int
         include_crumbs=True,
         per_page=limit,
         root_filter=root_filter,
+        count_mode=CountModes.capped,
     )
 
-    return await paginator.get_paginated_result(page, Transaction, exclude_fields=["wallet"])
+    return await paginator.get_paginated_result(page, Transaction, exclude_fields=["wallet"], after=after)
 
 
 # get a single tx that belomgs to a user
@@ -338,7 +335,7 @@ async def withdraw_from_wallet(body:  WithdrawalInput, kyced: bool = Depends(onl
         balance_after=wallet.balance - body.amount,
     )
 
-    result = _initiate_withdrawal(transaction, auth_context, bank_account)
+    result = await _initiate_withdrawal(transaction, auth_context, bank_account)
 
     tx_status = result["status"]
 
@@ -370,7 +367,7 @@ async def topup_wallet(body:  TopupInput,  paid_membership_fee: bool = Depends(o
 
     # initiate the transaction on flutterwave
 
-    result = _initiate_topup_payment(transaction, auth_context)
+    result = await _initiate_topup_payment(transaction, auth_context)
 
     api_response = {
         "redirect_url": result["link"],
@@ -386,103 +383,4 @@ async def topup_wallet(body:  TopupInput,  paid_membership_fee: bool = Depends(o
 @router.get("/top-up/complete", status_code=200)
 async def complete_topup_wallet(req:  Request, ):
 
-    query = req.query_params
-
-    tx_status = query.get("status", None)
-    tx_ref = query.get("tx_ref", None)
-    tx_id = query.get("transaction_id", None)
-
-    if not tx_status or not tx_ref:
-        logger.error(
-            f"Invalid payment request parameters - {tx_status} {tx_ref} {tx_id}")
-        raise HTTPException(
-            status_code=400, detail="Invalid payment request parameters")
-
-    # find the transaction
-
-    transaction:  Transaction = await find_record(Transaction, Collections.transactions, "reference", tx_ref, raise_404=False)
-
-    payment_rejection_url = f"{settings.app_url}?showTx=true&txStatus=failed&txRef={tx_ref}"
-    payment_success_url = f"{settings.app_url}?showTx=true&txStatus=successful&txRef={tx_ref}"
-
-    failed_redirect = RedirectResponse(payment_rejection_url)
-    success_redirect = RedirectResponse(payment_success_url)
-
-    if not transaction:
-        logger.error(
-            f"Transaction with reference {tx_ref} not found")
-        return failed_redirect
-
-    if transaction.status == TransactionStatus.successful:
-        return success_redirect
-
-    if transaction.status == TransactionStatus.failed:
-        return failed_redirect
-
-    if transaction.type != TransactionType.topup:
-        logger.error(
-            f"Transaction with reference {tx_ref} is not a topup transaction")
-        return failed_redirect
-
-    if transaction.direction != TransactionDirection.incoming:
-        logger.error(
-            f"Transaction with reference {tx_ref} is not an incoming transaction")
-        return failed_redirect
-
-    if tx_status == "successful" or tx_status == "completed":
-
-        # verify the transaction on flutterwave
-        result = _verify_transaction(tx_id, transaction.initiator)
-
-        if result["tx_ref"] != transaction.reference:
-            logger.error(
-                f"Transaction reference mismatch - {tx_ref} {transaction.reference}")
-            return failed_redirect
-
-        if result["status"] != "successful":
-            logger.error(
-                f"Transaction status mismatch - {tx_ref} {result['status']}")
-            return failed_redirect
-
-        if transaction.amount > result["amount"]:
-            logger.error(
-                f"Transaction amount mismatch - {tx_ref} {result['amount']}")
-            return failed_redirect
-
-        # update the transaction status to completed
-
-        transaction.status = TransactionStatus.successful
-
-        transaction.tx_id = tx_id
-
-        # update  corresponding wallet
-
-        wallet: Wallet = await find_record(Wallet, Collections.wallets, "uid", transaction.wallet)
-
-        wallet.balance += transaction.amount
-
-        transaction.balance_after = wallet.balance
-
-        wallet.total_amount_deposited += transaction.amount
-        wallet.last_transaction_at = transaction.created_at
-
-        await update_record(Wallet, wallet.model_dump(), Collections.wallets, "uid", refresh_from_db=True)
-
-        await update_record(Transaction, transaction.model_dump(), Collections.transactions, "reference", refresh_from_db=True)
-
-        # send a notification
-
-        task_create_notification(
-            transaction.initiator,  NotificationTypes.wallet, "Added funds successfully", f"Your funding of {transaction.amount} was successful")
-
-        return success_redirect
-
-    else:
-
-        # update the transaction status to failed
-
-        transaction.status = TransactionStatus.failed
-
-        await update_record(Transaction, transaction.model_dump(), Collections.transactions, "reference", refresh_from_db=True)
-
-        return failed_redirect
+    return await _get_payment_redirect(req, [TransactionType.topup])